@@ -0,0 +1,140 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+BASE = '__base__'
+
+
+def _add(left, right):
+    # Categories or districts new to ``right`` extend the union of labels.
+    if isinstance(left, pd.Series):
+        return left.add(right, fill_value=0).astype(np.int64)
+    return left.add(right, fill_value=0).fillna(0).astype(np.int64)
+
+
+class DistrictCube:
+    """Interview counts per district, missing districts included."""
+
+    def __init__(self, data):
+        self.district_sizes = data['District'].value_counts(dropna=False)
+
+    def districts(self, selected=None):
+        sizes = self.district_sizes.drop([d for d in self.district_sizes.index if pd.isna(d)])
+        if selected:
+            sizes = sizes[sizes.index.isin(selected)]
+        return sorted(sizes[sizes > 0].index)
+
+    def interviews(self, selected=None):
+        if selected:
+            return int(self.district_sizes[self.district_sizes.index.isin(selected)].sum())
+        return int(self.district_sizes.sum())
+
+    def merge(self, other):
+        """Return a new cube holding the counts of both ``self`` and ``other``
+        (a cube of the same kind built over newly appended rows)."""
+        merged = copy.copy(self)
+        merged.district_sizes = _add(self.district_sizes, other.district_sizes)
+        return merged
+
+
+class CountCube(DistrictCube):
+    """Per-(variable, category, district) interview counts.
+
+    Built once per data version over the full dataset; filtering by district
+    is a column selection and sum over the stored cells, never a rescan.
+    """
+
+    def __init__(self, data, variables):
+        super().__init__(data)
+        self.counts = {}
+        for var in dict.fromkeys(variables):
+            if var in data.columns:
+                self.counts[var] = (data.groupby([var, 'District'], observed=True).size()
+                                    .unstack('District', fill_value=0))
+
+    def merge(self, other):
+        merged = super().merge(other)
+        merged.counts = {var: _add(counts, other.counts[var]) if var in other.counts else counts
+                         for var, counts in self.counts.items()}
+        return merged
+
+    def table(self, var, selected=None):
+        # Categories with no interviews in the selected districts drop out,
+        # just as they would from a groupby over the filtered rows.
+        counts = self.counts[var].reindex(columns=self.districts(selected), fill_value=0)
+        return counts[counts.sum(axis=1) > 0]
+
+
+class MultiResponseCube(DistrictCube):
+    """Option x district counts and "any selected" bases per multi-response group.
+
+    Each group is coerced once into a uint8 indicator matrix; all counts and
+    bases come from a single bincount over (district, option) cells.
+    """
+
+    def __init__(self, data, groups):
+        super().__init__(data)
+        codes, self.district_index = pd.factorize(data['District'], use_na_sentinel=False)
+        self.groups = {}
+        for prefix, columns in groups.items():
+            values = data[columns].apply(pd.to_numeric, errors='coerce')
+            matrix = np.empty((len(values), len(columns) + 1), dtype=np.uint8)
+            matrix[:, :-1] = (values == 1).to_numpy()
+            matrix[:, -1] = (values.sum(axis=1) > 0).to_numpy()
+            rows, options = np.nonzero(matrix)
+            counts = np.bincount(codes[rows] * matrix.shape[1] + options,
+                                 minlength=len(self.district_index) * matrix.shape[1])
+            counts = counts.reshape(len(self.district_index), matrix.shape[1])
+            self.groups[prefix] = pd.DataFrame(counts.T, index=list(columns) + [BASE],
+                                               columns=self.district_index)
+
+    def merge(self, other):
+        merged = super().merge(other)
+        merged.groups = {prefix: _add(group, other.groups[prefix]) for prefix, group in self.groups.items()}
+        return merged
+
+    def table(self, prefix, selected=None):
+        """Return (counts, bases): option x district counts with a Total column,
+        and the per-district respondent bases with the same columns."""
+        districts = self.districts(selected)
+        group = self.groups[prefix]
+        counts = group.drop(BASE).reindex(columns=districts, fill_value=0)
+        counts['Total'] = counts.sum(axis=1)
+        bases = group.loc[BASE]
+        if selected:
+            base_total = bases[bases.index.isin(selected)].sum()
+        else:
+            base_total = bases.sum()
+        bases = bases.reindex(districts, fill_value=0)
+        bases['Total'] = base_total
+        return counts, bases
+
+
+def _codes(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+
+class CrossTabCube:
+    """Interview counts per (row answer, column answer, district) of one pair
+    of variables, from a single bincount over their integer codes; a district
+    selection is then a sum over the last axis."""
+
+    def __init__(self, data, row_var, col_var):
+        row_codes, self.row_labels = _codes(data[row_var])
+        col_codes, self.col_labels = _codes(data[col_var])
+        district_codes, self.district_labels = pd.factorize(data['District'], sort=True)
+        valid = (row_codes >= 0) & (col_codes >= 0) & (district_codes >= 0)
+        shape = (len(self.row_labels), len(self.col_labels), len(self.district_labels))
+        cells = np.ravel_multi_index((row_codes[valid], col_codes[valid], district_codes[valid]), shape)
+        self.counts = np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+
+    def table(self, selected=None):
+        """Row answer x column answer counts within the ``selected``
+        districts (all when empty), answers with no interviews dropped."""
+        keep = [i for i, district in enumerate(self.district_labels) if not selected or district in selected]
+        counts = pd.DataFrame(self.counts[:, :, keep].sum(axis=2), index=self.row_labels,
+                              columns=self.col_labels)
+        return counts.loc[counts.sum(axis=1) > 0, counts.sum(axis=0) > 0]
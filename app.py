@@ -1,10 +1,20 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import re
-import requests
-from io import BytesIO
-import plotly.express as px
+import os
+import time
+from functools import partial
+import metrics
+import warmup
+from artifacts import (comparison_artifacts, crosstab_artifacts, export_workbook, indicator_artifacts,
+                       multi_response_artifacts, question_title, single_response_artifacts, unmatched_indicators,
+                       warm_module)
+from registry import MODULES, MODULES_BY_NAME
+from schema import CLUSTER_COLUMN, WEIGHT_COLUMN
+from shared_cache import SharedCache, backend_from_url
+from snapshot import CACHE_DIR
+from store import WorkbookStore
+from validation import CHECKS, COLUMN_CHECKS
 
 st.set_page_config(layout="wide", page_title="MNHN Dashboard")
 
@@ -28,185 +38,158 @@ if not st.session_state.get('auth', False):
     login_form()
     st.stop()
     
-
-@st.cache_data
-def load_data():
+# Timing spans, payload sizes and cache counters; off unless the "metrics"
+# secret (or MNHN_METRICS=1) is set. Users listed under "admins" see them.
+metrics.configure(st.secrets.get("metrics", os.environ.get("MNHN_METRICS") == "1"),
+                  st.secrets.get("metrics_log", os.environ.get("MNHN_METRICS_LOG")))
+page_started = time.perf_counter()
+
+# One WorkbookStore per process, shared by every session. It hands each rerun
+# the same frame instead of an unpickled copy. store turns on pandas
+# copy-on-write, so a frame derived from it (a filter, a column subset) copies
+# before it is modified; assigning into workbook.data itself is still a
+# write every session sees, so nothing here does. Module aggregates are built
+# on first visit and, when a sync only appends interviews, updated from the
+# new rows alone.
+#
+# With several replicas, point the "shared_cache" secret (or
+# MNHN_SHARED_CACHE) at a shared directory or Redis: a sync on any replica
+# then publishes the new version to all of them, and only one fetches it.
+@st.cache_resource
+def get_shared_backend():
+    return backend_from_url(st.secrets.get("shared_cache", os.environ.get("MNHN_SHARED_CACHE")))
+
+
+@st.cache_resource
+def get_store():
+    return WorkbookStore(shared=SharedCache(get_shared_backend(), "endline"))
+
+
+def source_url():
     file_id = st.secrets["id"]
     gdrive_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-    response = requests.get(gdrive_url)
-    xls = pd.ExcelFile(BytesIO(response.content))
-    data = xls.parse("Database")
-    key = xls.parse("Key")
-    try:
-        key_mrq = xls.parse("Key_MRQ")
-        mrq_text_dict = dict(zip(key_mrq['Variable'], key_mrq['TEXT']))
-    except Exception as e:
-        st.warning(f"Key_MRQ sheet not loaded: {str(e)}")
-        mrq_text_dict = {}
-    return data, key, mrq_text_dict
-if st.button("🔄 Sync Latest Data"):
-    st.cache_data.clear()
-    st.success("Data refreshed from Google Drive! Please wait...")
-    st.rerun()
-    
-data, key, mrq_text_dict = load_data()
-rename_dict = dict(zip(key['Variables'], key['TEXT']))
+    return st.secrets.get("source_url", gdrive_url)
 
 
-data['cb4'] = pd.to_numeric(data['cb4'], errors='coerce')
+# The baseline round, when configured, is a second workbook with the same
+# layout; it gets its own store and snapshot directory.
+@st.cache_resource
+def get_baseline_store():
+    return WorkbookStore(os.path.join(CACHE_DIR, "baseline"), SharedCache(get_shared_backend(), "baseline"))
 
-data = data.dropna(subset=['cb4'])
-bins = [-1, 3, 7, 11]
-labels = ['0 - 3 Months', '4 - 7 Months', '8 - 11 Months']
-data['cb4_class'] = pd.cut(data['cb4'], bins=bins, labels=labels)
 
+def baseline_url():
+    if "baseline_id" in st.secrets:
+        return f"https://drive.google.com/uc?export=download&id={st.secrets['baseline_id']}"
+    return st.secrets.get("baseline_url")
 
-data['AC2'] = pd.to_numeric(data['AC2'], errors='coerce').fillna(0).astype(int)
 
-def ac2_group(val):
-    if val >= 8:
-        return '8 and above'
+# Charts and N/% tables are built once per (question, district selection)
+# on the Workbook and shared by every session until the data changes. With
+# the "chart_max_categories" secret set, long tails collapse into "Other".
+CHART_MAX_CATEGORIES = st.secrets.get("chart_max_categories")
+
+
+store = get_store()
+if st.button("🔄 Sync Latest Data"):
+    warmup.cancel()
+    store.refresh(source_url())
+    if baseline_url():
+        get_baseline_store().refresh(baseline_url())
+    try:
+        if st.secrets.get("delta_path") and os.path.exists(st.secrets["delta_path"]):
+            store.ingest_delta(st.secrets["delta_path"])
+    except ValueError as e:
+        # The source itself was refreshed; the page goes on with it.
+        st.error(f"Delta file not loaded: {e}")
     else:
-        return str(val)
-
-
-data['AC2_new'] = data['AC2'].apply(ac2_group)
-
-
-
-import re
-
-
-multi_select_groups = {}
-for col in data.columns:
-    match = re.match(r"(.*)_(\d+)$", col)
-    if match:
-        prefix = match.group(1)
-        multi_select_groups.setdefault(prefix, []).append(col)
-
-
-def summary_charts_tables(data, var_list, mappings, module_key):
-    for var in single_cats:
-            if var in data.columns:
-                
-                var_title = mrq_text_dict.get(var, rename_dict.get(var, var))
-                
-                
-                group_df = data.groupby([var, 'District']).size().reset_index(name='Count')
-                fig = px.bar(group_df, x=var, y='Count', color='District', barmode='group',
-                            labels={var: var_title, 'Count': 'Count', 'District': 'District'},
-                            title=var_title)
-                fig.update_layout(title={'text': var_title, 'font': {'size': 32}})
-                fig.update_layout(
-                dragmode=False,  # Disable zooming and panning
-                xaxis=dict(fixedrange=True),  # Disable x-axis zooming
-                yaxis=dict(fixedrange=True)  # Disable y-axis zooming
-            )            
-                st.plotly_chart(fig, use_container_width=True)
-
-                
-                districts_list = sorted(data['District'].dropna().unique())
-                count_table = data.pivot_table(index=var, columns='District', aggfunc='size', fill_value=0)
-                count_table['Total'] = count_table.sum(axis=1)
-                
-                col_totals = count_table.sum(axis=0)
-                
-                percent_table = count_table.div(col_totals, axis=1).fillna(0) * 100
-                percent_table = percent_table.round(1)
-                
-                columns_n_pct = []
-                for col in districts_list + ['Total']:
-                    columns_n_pct.append((col, 'N'))
-                    columns_n_pct.append((col, '%'))
-                
-                final_rows = []
-                for idx in count_table.index:
-                    row = []
-                    for col in districts_list + ['Total']:
-                        row.append(count_table.loc[idx, col])
-                        row.append(f"{percent_table.loc[idx, col]:.1f}%")
-                    final_rows.append([idx] + row)
-                
-                total_row = ['Total']
-                for col in districts_list + ['Total']:
-                    total_row.append(col_totals[col])
-                    total_row.append("100.0%")
-                final_rows.append(total_row)
-                
-                columns = [''] + [item for col in districts_list + ['Total'] for item in (col, '')]
-               
-                def render_n_pct_table(columns, rows, var_title):
-                    header_color = "#2905f5"
-                    total_color =  "#5337f3"
-                    html = '<style>\n'
-                    html += 'table.customtbl {border-collapse: collapse; width: 100%;}' + '\n'
-                    html += 'table.customtbl th {background: %s; font-weight: bold; border: 1px solid #aaa; padding: 6px;}' % header_color + '\n'
-                    html += 'table.customtbl td {border: 1px solid #aaa; padding: 6px;}' + '\n'
-                    html += '</style>\n'
-                    html += f'<table class="customtbl">\n'
-                    
-                    html += '<tr><th rowspan="2">{}</th>'.format(var_title)
-                    for col in districts_list + ['Total']:
-                        html += f'<th colspan="2">{col}</th>'
-                    html += '</tr>\n'
-                    
-                    html += '<tr>'
-                    for _ in districts_list + ['Total']:
-                        html += '<th>N</th><th>%</th>'
-                    html += '</tr>\n'
-                   
-                    for row in rows:
-                        is_total_row = str(row[0]).lower() == 'total'
-                        html += '<tr>'
-                        
-                        if is_total_row:
-                            html += f'<td style="font-weight:bold;background:{total_color}">{row[0]}</td>'
-                        else:
-                            html += f'<td style="font-weight:bold">{row[0]}</td>'
-                        
-                        for i, val in enumerate(row[1:]):
-                            is_total_col = (i // 2 == len(districts_list))
-                            cell_style = ''
-                            if is_total_row or is_total_col:
-                                cell_style = f'font-weight:bold;background:{total_color}'
-                            html += f'<td style="{cell_style}">{val}</td>'
-                        html += '</tr>\n'
-                    html += '</table>'
-                    return html
-
-                st.markdown(render_n_pct_table(columns, final_rows, var_title), unsafe_allow_html=True)
-
-                
-                import csv
-                import io
-                csv_buffer = io.StringIO()
-                
-                writer = csv.writer(csv_buffer)
-                
-                header_row1 = [var_title]
-                for col in districts_list + ['Total']:
-                    header_row1.extend([col, ''])
-                writer.writerow(header_row1)
-                
-                header_row2 = [''] + [item for _ in districts_list + ['Total'] for item in ('N', '%')]
-                writer.writerow(header_row2)
-               
-                for row in final_rows:
-                    writer.writerow(row)
-                csv_data = csv_buffer.getvalue().encode('utf-8')
-                st.download_button(
-                    label="Download table as CSV",
-                    data=csv_data,
-                    file_name=f"{var_title}_table.csv",
-                    mime="text/csv"
-                )
+        st.success("Data refreshed from Google Drive! Please wait...")
+        st.rerun()
+    
+workbook = store.latest(source_url())
+if workbook.mrq_error:
+    st.warning(f"Key_MRQ sheet not loaded: {workbook.mrq_error}")
+data, key, mrq_text_dict, data_version = workbook.data, workbook.key, workbook.mrq_text_dict, workbook.version
+rename_dict = workbook.rename_dict
+baseline = None
+if baseline_url():
+    baseline_store = get_baseline_store()
+    baseline = baseline_store.latest(baseline_url())
+
+
+def show_chart(chart, name):
+    with metrics.span("render.plotly_chart", var=name):
+        st.plotly_chart(chart.figure, use_container_width=True)
+    metrics.payload("plotly_chart", lambda: len(chart.json()), var=name)
+
+
+def show_table(html, name):
+    with metrics.span("render.markdown", var=name):
+        st.markdown(html, unsafe_allow_html=True)
+    metrics.payload("markdown", lambda: len(html.encode()), var=name)
+
+
+# Long pages are split into pages of PAGE_SIZE questions with a search box;
+# only the questions on the visible page are turned into charts and tables.
+PAGE_SIZE = st.secrets.get("page_size", 5)
+
+
+def visible_questions(names, titles, page_key):
+    query = st.text_input("Search questions", key=f"search_{page_key}",
+                          placeholder="Variable name or question text").strip().lower()
+    if query:
+        names = [name for name in names if query in str(name).lower() or query in str(titles[name]).lower()]
+        if not names:
+            st.info("No questions match your search.")
+            return []
+    pages = -(-len(names) // PAGE_SIZE)
+    if pages <= 1:
+        return names
+    page = st.radio("Page", range(1, pages + 1), horizontal=True, key=f"page_{page_key}_{query}")
+    start = (page - 1) * PAGE_SIZE
+    st.caption(f"Showing questions {start + 1}–{min(start + PAGE_SIZE, len(names))} of {len(names)}")
+    return names[start:start + PAGE_SIZE]
+
+
+def summary_charts_tables(module, cube, selected_districts):
+    titles = {var: question_title(var, mrq_text_dict, rename_dict) for var in module.single_cats if var in cube.counts}
+    for var in visible_questions(list(titles), titles, module.key):
+        var_title = titles[var]
+        
+        with metrics.span("build.artifacts", var=var):
+            chart, html, csv_data = single_response_artifacts(workbook, module.name, var, var_title,
+                                                            tuple(sorted(selected_districts)), CHART_MAX_CATEGORIES,
+                                                            show_estimates)
+        show_chart(chart, var)
+        show_table(html, var)
+        st.download_button(
+            label="Download table as CSV",
+            data=csv_data,
+            file_name=f"{var_title}_table.csv",
+            mime="text/csv"
+        )
+        if show_baseline:
+            with metrics.span("build.comparison", var=var):
+                chart, html, csv_data = comparison_artifacts(workbook, baseline, module.name, var, var_title,
+                                                           tuple(sorted(selected_districts)))
+            st.markdown(f"**Baseline vs endline: {var_title}**")
+            show_chart(chart, var)
+            show_table(html, var)
+            st.download_button(
+                label="Download comparison as CSV",
+                data=csv_data,
+                file_name=f"{var_title}_baseline_endline.csv",
+                mime="text/csv",
+                key=f"comparison_{module.key}_{var}"
+            )
 
 
 # --- KPIs ---
 st.title("📊 Endline Assessment of MNHN Program using the NIMS toolkit (Nutrition Intervention Monitoring Surveys (NIMS)")
 st.info(f"You are logged in as: {st.session_state['username']}")
 
-districts = sorted(data["District"].dropna().unique())
+district_index = workbook.districts
+districts = district_index.districts()
 default_selection = districts  
 
 selected_districts = st.multiselect(
@@ -217,38 +200,65 @@ selected_districts = st.multiselect(
 )
 
 
-if selected_districts:
-    data = data[data["District"].isin(selected_districts)]
-else:
-    data = data
-
 
 district_display = "All Districts" if len(selected_districts) == len(districts) else ", ".join(selected_districts)
 col1, col2 = st.columns([5, 2])  
 with col1:
     st.subheader(f"Districts: {district_display}")
 with col2:
-    st.markdown(f"<div style='text-align: right; font-size: 1.3em; font-weight: bold;'>Total Interviews: {len(data)}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div style='text-align: right; font-size: 1.3em; font-weight: bold;'>Total Interviews: {district_index.interviews(selected_districts)}</div>", unsafe_allow_html=True)
 st.caption(f"🔄 All Charts are dynamically updated based on your selected District(s): {district_display}")
+show_estimates = st.toggle(
+    "Show weighted % and 95% CI",
+    help=f"Design-weighted percentages with cluster-robust 95% confidence intervals "
+         f"(weights: '{WEIGHT_COLUMN}', clusters: '{CLUSTER_COLUMN}' within each district)."
+)
+if show_estimates and WEIGHT_COLUMN not in data.columns:
+    st.caption(f"No '{WEIGHT_COLUMN}' column in the data: estimates are unweighted, with cluster-robust intervals.")
+# The all-modules workbook is only assembled when asked for, then kept per
+# district selection like the other artifacts.
+export_selection = tuple(sorted(selected_districts))
+if st.button("📥 Export all tables to Excel"):
+    st.session_state["export_selection"] = export_selection
+if st.session_state.get("export_selection") == export_selection:
+    with metrics.span("build.export"):
+        xlsx_data = export_workbook(workbook, export_selection)
+    metrics.payload("export", len(xlsx_data))
+    st.download_button(
+        label="Download all tables (XLSX)",
+        data=xlsx_data,
+        file_name="mnhn_tables.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+show_baseline = baseline is not None and st.toggle(
+    "Compare with baseline", help="Baseline and endline % of each answer side by side, with the change per district."
+)
 
+# Every module's aggregates and its default (all districts) charts and tables
+# are built in the background, so switching modules later is instant.
+warm = warmup.start(data_version, lambda: {
+    module.name: partial(warm_module, workbook, module, tuple(districts), max_categories=CHART_MAX_CATEGORIES)
+    for module in MODULES if module.single_cats or module.multi_response
+})
+warm_polling = not warm.done
 
 
-modules = [
-    "EXECUTIVE SUMMARY",
-    "Module : Basic Information",
-    "BACKGROUND MODULE: INFANT/CHILD",
-    "MODULE 1: ANC",
-    "MODULE 2: IRON/IRON AND FOLIC ACID CONTAINING SUPPLEMENTS",
-    "MODULE 3: IFA BCI",
-    "MODULE 4: SKILLED BIRTH ATTENDANCE & CARE POST-DELIVERY",
-    "MODULE 5: BREAST FEEDING",
-    "MODULE 6: COUNSELLING IYCF",
-    "MODULE 7: BENEFICIARY KNOWLEDGE – BREAST FEEDING",
-    "MODULE 8: KANGAROO CARE",
-    "MODULE 9: WORK AND TIME USAGE QUESTIONS",
-    "MODULE 10: New Gender questions for endline",
-    "Analysis of Multi-Response Variables"
-]
+@st.fragment(run_every=1 if warm_polling else None)
+def warmup_progress():
+    if not warm.done:
+        st.progress(warm.completed / warm.total,
+                    text=f"Preparing module pages in the background: {warm.completed} of {warm.total} ready")
+    elif warm_polling:
+        # run_every is fixed for this page run; only a full rerun stops it.
+        st.rerun(scope="app")
+
+
+warmup_progress()
+
+
+
+EXPLORER = "CROSS-TAB EXPLORER"
+modules = [module.name for module in MODULES] + [EXPLORER]
 st.markdown("""
     <style>
     div[role="radiogroup"] > label, div[role="radiogroup"] > div > label {
@@ -263,6 +273,24 @@ active_module = st.radio("Select Module from the following to see the insights",
 st.header(f"📊 {active_module}")
 if active_module == "EXECUTIVE SUMMARY":
     st.markdown("---")
+    st.subheader("Key indicators")
+    with metrics.span("build.indicators"):
+        html, csv_data = indicator_artifacts(workbook, tuple(sorted(selected_districts)))
+    show_table(html, "indicators")
+    st.caption("The table covers ANC visits and the \"Yes\" share of IF1, IF2, BF1, BF2 and SB1. "
+               "At least 90 IFA tablets and stockout rates are not included, as the data has no such "
+               "columns. The summary text below is written by hand for all districts and does not "
+               "follow the data or the district selection.")
+    unmatched = unmatched_indicators(workbook)
+    if unmatched:
+        st.warning("No answers in the data match these indicators, so they are shown as –: "
+                   + "; ".join(unmatched))
+    st.download_button(
+        label="Download indicators as CSV",
+        data=csv_data,
+        file_name="key_indicators.csv",
+        mime="text/csv"
+    )
     st.markdown("""
 <style>
     .section-heading {font-size: 24pt;font-weight: bold;    }
@@ -302,221 +330,60 @@ Stock shortages of IFA supplements have improved significantly among most distri
 
 
 
-# --- Module : Basic Information ---
-elif active_module == "Module : Basic Information":
-    st.markdown("---")
-    
-    single_cats = ['Cluster_Area','MB3','MB4', 'MB5'] 
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Basic_Info")
-
-# --- BACKGROUND MODULE: INFANT/CHILD ---
-
-elif active_module == "BACKGROUND MODULE: INFANT/CHILD":
-    st.markdown("---")
-    
-    single_cats = ['cb2','cb4_class']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Background_Child")
-
-# --- "MODULE 1: ANC ---
-elif active_module == "MODULE 1: ANC":
-    st.markdown("---")
-    
-    single_cats = ['AC1','AC2_new', 'AC5','AC7']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "ANC")
-
-
-# --- MODULE 2: IRON/IRON AND FOLIC ACID CONTAINING SUPPLEMENTS ---
-elif active_module == "MODULE 2: IRON/IRON AND FOLIC ACID CONTAINING SUPPLEMENTS":
-    st.markdown("---")
-    
-    single_cats = ['IF1','IF2']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Iron_Supplement")
-
-# --- MODULE 3: IFA BCI ---
-elif active_module == "MODULE 3: IFA BCI":
-    st.markdown("---")
-    
-    single_cats = ['BC1','BC4', 'BC40']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "IFA_BCI")
-
-# --- MODULE 4: SKILLED BIRTH ATTENDANCE & CARE POST-DELIVERY---
-elif active_module == "MODULE 4: SKILLED BIRTH ATTENDANCE & CARE POST-DELIVERY":
-    st.markdown("---")
-    
-    single_cats = ['SB1','SB1_A1','SB1_A2','SB1_A3','SB3','SB4','SB5']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "SBA_Care")
-
-# --- MODULE 5: BREAST FEEDING ---
-elif active_module == "MODULE 5: BREAST FEEDING":
-    st.markdown("---")
-    
-    single_cats = ['BF1','BF2','BF4','BF6','BF8','BF9']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "BreastFeeding")
-
-# ---  MODULE 6: COUNSELLING IYCF ---
-elif active_module == "MODULE 6: COUNSELLING IYCF":
-    st.markdown("---")
-   
-    single_cats = ['CL1']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Counselling_IYCF")
-
-# --- MODULE 7: BENEFICIARY KNOWLEDGE – BREAST FEEDING ---
-elif active_module == "MODULE 7: BENEFICIARY KNOWLEDGE – BREAST FEEDING":
+elif active_module == EXPLORER:
     st.markdown("---")
-    
-    single_cats = ['BKB1','BKB2']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Beneficiary_Knowledge_BF")
-
-# --- MODULE 8: KANGAROO CARE ---
-elif active_module == "MODULE 8: KANGAROO CARE":
-    st.markdown("---")
-    
-    single_cats = ['KC2','KC3','KC4','KC5','KC6','KC8']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "KangarooCare")
-
-# --- MODULE 9: WORK AND TIME USAGE QUESTIONS ---
-elif active_module == "MODULE 9: WORK AND TIME USAGE QUESTIONS":
-    st.markdown("---")
-   
-    single_cats = ['WT1','WT8']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Work_Time")
+    # Any two categorical variables, Key sheet variables first.
+    variables = [var for var in dict.fromkeys(list(key['Variables'].dropna()) + list(workbook.schema))
+                 if workbook.schema.get(var) == 'category']
+    titles = {var: f"{var}: {question_title(var, mrq_text_dict, rename_dict)}" for var in variables}
+    col1, col2 = st.columns(2)
+    with col1:
+        row_var = st.selectbox("Rows", variables, format_func=titles.get, key="crosstab_rows")
+    with col2:
+        col_var = st.selectbox("Columns", [var for var in variables if var != row_var], format_func=titles.get,
+                               key="crosstab_columns")
+    with metrics.span("build.crosstab", var=f"{row_var}x{col_var}"):
+        artifacts = crosstab_artifacts(workbook, row_var, col_var, tuple(sorted(selected_districts)),
+                                       CHART_MAX_CATEGORIES)
+    if artifacts:
+        chart, html, csv_data = artifacts
+        show_chart(chart, f"{row_var}x{col_var}")
+        show_table(html, f"{row_var}x{col_var}")
+        st.download_button(
+            label="Download table as CSV",
+            data=csv_data,
+            file_name=f"{row_var}_by_{col_var}_table.csv",
+            mime="text/csv"
+        )
+    else:
+        st.info("No interviews in the selected districts answered both questions.")
 
-# --- MODULE 10: New Gender questions for endline ---
-elif active_module == "MODULE 10: New Gender questions for endline":
+elif MODULES_BY_NAME[active_module].single_cats:
     st.markdown("---")
     
-    single_cats = ['GE1','GE2','GE3','GE4','GE5_A','GE5_B','GE5_C','GE5_D','GE5_E']  
-    summary_charts_tables(data, single_cats, mrq_text_dict, "Endline_Gender")
+    module = MODULES_BY_NAME[active_module]
+    module_cube = workbook.cube(module.name)
+    summary_charts_tables(module, module_cube, selected_districts)
 
 # --- Analysis of Multi-Response Variables ---
 elif active_module == "Analysis of Multi-Response Variables":
     st.markdown("---")
     
+    multi_cube = workbook.cube(active_module)
+    questions = {prefix: question_title(prefix, mrq_text_dict, rename_dict) for prefix in multi_cube.groups}
 
-    for prefix, columns in multi_select_groups.items():
-        main_question = mrq_text_dict.get(prefix, rename_dict.get(prefix, prefix))
-        
-        option_labels = [mrq_text_dict.get(col, rename_dict.get(col, col)) for col in columns]
+    for prefix in visible_questions(list(questions), questions, MODULES_BY_NAME[active_module].key):
+        main_question = questions[prefix]
         st.subheader(main_question)
 
         
-        for col in columns:
-            if col in data.columns:
-                data[col] = pd.to_numeric(data[col], errors='coerce')
-
-        
-        records = []
-        districts_list = sorted(data['District'].dropna().unique())
-        for col, label in zip(columns, option_labels):
-            if col in data.columns:
-                selected_mask = data[col].apply(lambda x: str(x).strip().lower() in ['1', 'yes', 'true']) | (data[col] == 1)
-                for district in districts_list:
-                    count = ((data['District'] == district) & selected_mask).sum()
-                    records.append({'Option': label, 'District': district, 'Count': count})
-        multi_df = pd.DataFrame(records)
-        if not multi_df.empty:
-            fig = px.bar(multi_df, x='Option', y='Count', color='District', barmode='group',
-                        title=main_question)
-            st.plotly_chart(fig, use_container_width=True)
-
-            
-            table = pd.DataFrame(index=option_labels, columns=districts_list)
-            for label, col in zip(option_labels, columns):
-                if col in data.columns:
-                    selected_mask = data[col].apply(lambda x: str(x).strip().lower() in ['1', 'yes', 'true']) | (data[col] == 1)
-                    for district in districts_list:
-                        table.loc[label, district] = ((data['District'] == district) & selected_mask).sum()
-            table['Total'] = table.sum(axis=1)
-
-            
-            final_rows = []
-            for idx in table.index:
-                row = [idx]
-                for col in districts_list:
-                    n = table.loc[idx, col]
-                    base_n = (data[data['District'] == col][columns].sum(axis=1) > 0).sum()
-                    pct = (n / base_n * 100) if base_n > 0 else 0
-                    row.append(n)
-                    row.append(f"{pct:.1f}%")
-                n_total = table.loc[idx, 'Total']
-                base_total = (data[columns].sum(axis=1) > 0).sum()
-                pct_total = (n_total / base_total * 100) if base_total > 0 else 0
-                row.append(n_total)
-                row.append(f"{pct_total:.1f}%")
-                final_rows.append(row)
-
-            
-            total_row = ['Total']
-            for col in districts_list:
-                base_n = (data[data['District'] == col][columns].sum(axis=1) > 0).sum()
-                total_row.append(base_n)
-                total_row.append("100.0%")
-            base_all = (data[columns].sum(axis=1) > 0).sum()
-            total_row.append(base_all)
-            total_row.append("100.0%")
-            final_rows.append(total_row)
-
-            
-            columns_table = [''] + [x for col in districts_list + ['Total'] for x in (col, '')]        
-           
-            def render_n_pct_table(columns, rows, var_title):
-                header_color = "#2905f5"
-                total_color =  "#5337f3"
-                html = '<style>\n'
-                html += 'table.customtbl {border-collapse: collapse; width: 100%;}' + '\n'
-                html += 'table.customtbl th {background: %s; font-weight: bold; border: 1px solid #aaa; padding: 6px;}' % header_color + '\n'
-                html += 'table.customtbl td {border: 1px solid #aaa; padding: 6px;}' + '\n'
-                html += '</style>\n'
-                html += f'<table class="customtbl">\n'
-               
-                html += '<tr><th rowspan="2">{}</th>'.format(var_title)
-                for col in districts_list + ['Total']:
-                    html += f'<th colspan="2">{col}</th>'
-                html += '</tr>\n'
-                
-                html += '<tr>'
-                for _ in districts_list + ['Total']:
-                    html += '<th>N</th><th>%</th>'
-                html += '</tr>\n'
-               
-                for row in rows:
-                    is_total_row = str(row[0]).lower() == 'total'
-                    html += '<tr>'
-                    
-                    if is_total_row:
-                        html += f'<td style="font-weight:bold;background:{total_color}">{row[0]}</td>'
-                    else:
-                        html += f'<td style="font-weight:bold">{row[0]}</td>'
-                   
-                    for i, val in enumerate(row[1:]):
-                        is_total_col = (i // 2 == len(districts_list))
-                        cell_style = ''
-                        if is_total_row or is_total_col:
-                            cell_style = f'font-weight:bold;background:{total_color}'
-                        html += f'<td style="{cell_style}">{val}</td>'
-                    html += '</tr>\n'
-                html += '</table>'
-                return html
-
-            st.markdown(render_n_pct_table(columns_table, final_rows, main_question), unsafe_allow_html=True)
-
-            
-            import csv
-            import io
-            csv_buffer = io.StringIO()
-            writer = csv.writer(csv_buffer)
-           
-            header_row1 = [main_question]
-            for col in districts_list + ['Total']:
-                header_row1.extend([col, ''])
-            writer.writerow(header_row1)
-           
-            header_row2 = [''] + [item for _ in districts_list + ['Total'] for item in ('N', '%')]
-            writer.writerow(header_row2)
-            
-            for row in final_rows:
-                writer.writerow(row)
-            csv_data = csv_buffer.getvalue().encode('utf-8')
+        with metrics.span("build.artifacts", var=prefix):
+            artifacts = multi_response_artifacts(workbook, active_module, prefix, tuple(sorted(selected_districts)),
+                                                 CHART_MAX_CATEGORIES, show_estimates)
+        if artifacts:
+            chart, html, csv_data = artifacts
+            show_chart(chart, prefix)
+            show_table(html, prefix)
             st.download_button(
                 label="Download table as CSV",
                 data=csv_data,
@@ -529,3 +396,45 @@ elif active_module == "Analysis of Multi-Response Variables":
 st.markdown("---")
 st.caption(f"Charts are dynamically updated based on your selected District(s): {district_display}")
 st.caption(f"The visualizations presented are for informational purposes only and do not constitute professional advice.")
+
+metrics.record_span("page", time.perf_counter() - page_started, module=active_module)
+is_admin = st.session_state['username'] in st.secrets.get("admins", [])
+# The data-quality report is built once per data version, at load.
+if is_admin and workbook.validation is not None:
+    with st.expander("🩺 Data quality (admin)"):
+        report = workbook.validation
+        st.caption("Checks of the raw Database sheet of this data version, before cleaning. Counts are interviews.")
+        if report.empty:
+            st.success("No problems found.")
+        else:
+            report = report.assign(problem=report['check'].map(CHECKS))
+            st.markdown("**By question**")
+            st.dataframe(report.groupby(['problem', 'column'], sort=False)['count'].sum().reset_index(),
+                         use_container_width=True, hide_index=True)
+            st.markdown("**By district and enumerator**")
+            answers = report[~report['check'].isin(COLUMN_CHECKS)]
+            st.dataframe(answers.pivot_table(index=['District', 'Enumerator'], columns='problem', values='count',
+                                             aggfunc='sum', fill_value=0, dropna=False),
+                         use_container_width=True)
+            st.download_button(
+                label="Download data-quality report as CSV",
+                data=report.to_csv(index=False).encode('utf-8'),
+                file_name="data_quality.csv",
+                mime="text/csv"
+            )
+if metrics.enabled() and is_admin:
+    with st.expander("⏱ Performance (admin)"):
+        stats = metrics.summary()
+        st.caption("Totals since the process started or the last reset; shared by every session.")
+        for title, table in [("Timing spans", stats["spans"]), ("Payload sizes", stats["payloads"]),
+                             ("Cache hits and misses", stats["caches"])]:
+            st.markdown(f"**{title}**")
+            if table:
+                st.dataframe(pd.DataFrame.from_dict(table, orient="index").sort_index(), use_container_width=True)
+            else:
+                st.caption("Nothing recorded yet.")
+        st.markdown("**Recent events**")
+        st.json(stats["recent"][-50:], expanded=False)
+        if st.button("Reset counters"):
+            metrics.reset()
+            st.rerun()
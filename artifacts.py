@@ -0,0 +1,196 @@
+"""Chart and N/% table artifacts for one question and district selection.
+
+They are memoised on the Workbook, so every session and the background
+warm-up share one copy per data version.
+"""
+from aggregates import CrossTabCube
+from charts import Chart, comparison_figure, crosstab_figure, multi_response_figure, single_response_figure
+from comparison import ROUND_LABELS, align_round, comparison_table
+from indicators import INDICATORS, evaluate, indicator_table
+from registry import MODULES, MODULES_BY_NAME
+from survey_stats import module_survey_cube
+from tables import (ESTIMATE_COLUMNS, N_PCT_COLUMNS, multi_response_rows, multi_response_table, n_pct_csv,
+                    n_pct_xlsx, render_n_pct_table, single_response_rows, single_response_table,
+                    with_estimates)
+from validation import key_code_labels
+
+def question_title(var, mrq_text_dict, rename_dict):
+    return mrq_text_dict.get(var, rename_dict.get(var, var))
+
+
+def survey_cube(workbook, module_name):
+    return workbook.artifact(('survey_cube', module_name),
+                             lambda: module_survey_cube(workbook.data, MODULES_BY_NAME[module_name]))
+
+
+def _tables(columns, rows, title, estimates):
+    """Table HTML and CSV, with weighted %/CI columns when ``estimates``
+    (percent, lower, upper frames aligned to ``rows``) are given."""
+    sub_columns = N_PCT_COLUMNS
+    if estimates is not None:
+        rows = with_estimates(rows, *(frame.to_numpy() for frame in estimates))
+        sub_columns = ESTIMATE_COLUMNS
+    return (render_n_pct_table(columns, rows, title, sub_columns),
+            n_pct_csv(columns, rows, title, sub_columns))
+
+
+def single_response_artifacts(workbook, module_name, var, var_title, selected, max_categories=None,
+                              estimates=False):
+    """(Chart, table HTML, table CSV) for one single-response variable;
+    ``estimates`` adds weighted % and 95% CI columns to the table."""
+    def build():
+        cube = workbook.cube(module_name)
+        count_table = cube.table(var, selected)
+        fig = single_response_figure(count_table, var, var_title, max_categories)
+        columns, rows = single_response_table(cube, var, selected)
+        weighted = None
+        if estimates:
+            weighted = [frame.reindex(index=count_table.index, columns=columns)
+                        for frame in survey_cube(workbook, module_name).estimates(var, selected)]
+        return (Chart(fig),) + _tables(columns, rows, var_title, weighted)
+
+    return workbook.artifact(('single_response', var, var_title, selected, max_categories, estimates), build)
+
+
+def multi_response_artifacts(workbook, module_name, prefix, selected, max_categories=None, estimates=False):
+    """(Chart, table HTML, table CSV) for one multi-response group, or None
+    when none of the selected districts has interviews."""
+    def build():
+        cube = workbook.cube(module_name)
+        counts, bases = cube.table(prefix, selected)
+        districts_list = list(bases.index[:-1])
+        if not districts_list:
+            return None
+        mrq_text_dict, rename_dict = workbook.mrq_text_dict, workbook.rename_dict
+        main_question = question_title(prefix, mrq_text_dict, rename_dict)
+        option_labels = [question_title(col, mrq_text_dict, rename_dict) for col in counts.index]
+        fig = multi_response_figure(counts, districts_list, option_labels, main_question, max_categories)
+        columns, rows = multi_response_table(cube, prefix, option_labels, selected)
+        weighted = None
+        if estimates:
+            weighted = [frame.reindex(index=counts.index, columns=columns)
+                        for frame in survey_cube(workbook, module_name).estimates(prefix, selected)]
+        return (Chart(fig),) + _tables(columns, rows, main_question, weighted)
+
+    return workbook.artifact(('multi_response', prefix, selected, max_categories, estimates), build)
+
+
+def aligned_baseline(workbook, baseline):
+    """The ``baseline`` Workbook aligned once to ``workbook``'s schema."""
+    return workbook.artifact(('baseline', baseline.version), lambda: align_round(baseline, workbook))
+
+
+def comparison_artifacts(workbook, baseline, module_name, var, var_title, selected):
+    """(Chart, table HTML, table CSV) pairing baseline and endline % of one
+    single-response variable, with the change per district."""
+    def build():
+        before = aligned_baseline(workbook, baseline).cube(module_name)
+        columns, rows, shares = comparison_table(before, workbook.cube(module_name), var, selected)
+        categories = [row[0] for row in rows[:-1]]
+        fig = comparison_figure(categories, shares[:, -1, :], ROUND_LABELS, var_title)
+        sub_columns = ROUND_LABELS + ('Change',)
+        return (Chart(fig), render_n_pct_table(columns, rows, var_title, sub_columns),
+                n_pct_csv(columns, rows, var_title, sub_columns))
+
+    return workbook.artifact(('comparison', baseline.version, var, var_title, selected), build)
+
+
+def crosstab_artifacts(workbook, row_var, col_var, selected, max_categories=None):
+    """(Chart, table HTML, table CSV) of ``row_var`` by ``col_var`` within
+    the selected districts, or None when they have no answers to both; the
+    counts behind every selection are built once per pair."""
+    def build():
+        cube = workbook.artifact(('crosstab_cube', row_var, col_var),
+                                 lambda: CrossTabCube(workbook.data, row_var, col_var))
+        count_table = cube.table(selected)
+        if count_table.empty:
+            return None
+        rename_dict = workbook.rename_dict
+        row_title = question_title(row_var, workbook.mrq_text_dict, rename_dict)
+        col_title = question_title(col_var, workbook.mrq_text_dict, rename_dict)
+        fig = crosstab_figure(count_table, row_title, col_title, max_categories)
+        columns, rows = list(count_table.columns) + ['Total'], single_response_rows(count_table)
+        return (Chart(fig), render_n_pct_table(columns, rows, row_title), n_pct_csv(columns, rows, row_title))
+
+    return workbook.artifact(('crosstab', row_var, col_var, selected, max_categories), build)
+
+
+def _evaluated_indicators(workbook):
+    return workbook.artifact(('indicators',),
+                             lambda: evaluate(INDICATORS, workbook.data, key_code_labels(workbook.key)))
+
+
+def _indicator_table(workbook, selected):
+    return indicator_table(INDICATORS, _evaluated_indicators(workbook), selected, workbook.rename_dict)
+
+
+def unmatched_indicators(workbook):
+    """Titles of the indicators whose answers match nothing in the data."""
+    unmatched = _evaluated_indicators(workbook)[3]
+    return [ind.title(workbook.rename_dict) for ind in INDICATORS if ind.key in unmatched]
+
+
+def indicator_artifacts(workbook, selected):
+    """(table HTML, table CSV) of the headline indicators; the per-district
+    counts behind them are computed once per data version."""
+    def build():
+        columns, rows = _indicator_table(workbook, selected)
+        sub_columns = ('%', 'N')
+        return (render_n_pct_table(columns, rows, "Indicator", sub_columns),
+                n_pct_csv(columns, rows, "Indicator", sub_columns))
+
+    return workbook.artifact(('indicator_table', selected), build)
+
+
+def export_workbook(workbook, selected):
+    """XLSX bytes of every module's N/% tables for ``selected``, a sheet per
+    module (the key indicators for the Executive Summary), built once per
+    selection."""
+    def build():
+        mrq_text_dict, rename_dict = workbook.mrq_text_dict, workbook.rename_dict
+        sheets = []
+        for module in MODULES:
+            tables = []
+            if module.multi_response:
+                cube = workbook.cube(module.name)
+                for prefix in cube.groups:
+                    counts, bases = cube.table(prefix, selected)
+                    if len(bases) > 1:
+                        option_labels = [question_title(col, mrq_text_dict, rename_dict) for col in counts.index]
+                        tables.append((question_title(prefix, mrq_text_dict, rename_dict), list(bases.index),
+                                       multi_response_rows(counts, bases, option_labels), N_PCT_COLUMNS))
+            elif module.single_cats:
+                cube = workbook.cube(module.name)
+                for var in module.single_cats:
+                    if var in cube.counts:
+                        columns, rows = single_response_table(cube, var, selected)
+                        tables.append((question_title(var, mrq_text_dict, rename_dict), columns, rows,
+                                       N_PCT_COLUMNS))
+            else:
+                columns, rows = _indicator_table(workbook, selected)
+                tables.append(("Indicator", columns, rows, ('%', 'N')))
+            if tables:
+                # Excel caps sheet names at 31 characters.
+                sheets.append((module.key[:31], tables))
+        return n_pct_xlsx(sheets)
+
+    return workbook.artifact(('export', selected), build)
+
+
+def warm_module(workbook, module, selected, cancelled, max_categories=None):
+    """Build ``module``'s cube and every question's artifacts for ``selected``,
+    stopping early once the ``cancelled`` event is set."""
+    cube = workbook.cube(module.name)
+    if module.multi_response:
+        for prefix in cube.groups:
+            if cancelled.is_set():
+                return
+            multi_response_artifacts(workbook, module.name, prefix, selected, max_categories)
+    else:
+        mrq_text_dict, rename_dict = workbook.mrq_text_dict, workbook.rename_dict
+        for var in module.single_cats:
+            if cancelled.is_set():
+                return
+            if var in cube.counts:
+                var_title = question_title(var, mrq_text_dict, rename_dict)
+                single_response_artifacts(workbook, module.name, var, var_title, selected, max_categories)
@@ -0,0 +1,171 @@
+"""Time each stage of the data pipeline on synthetic workbooks.
+
+    python -m benchmarks.run --rows 10000 100000 1000000 --districts 6
+    python -m benchmarks.run --rows 10000 100000 --save-baseline
+
+Stages are read (Excel parse), derive (validation, prepare_data and the schema),
+aggregate (every module cube) and render (N/% HTML and CSV for every table).
+Each stage records wall time and the process's peak RSS so far;
+``--trace-memory`` adds the stage's own peak allocation from tracemalloc,
+which slows the Excel parse down many times over. Results are compared
+against the stored baseline: a stage slower than the baseline by more than
+``--tolerance``, or tables whose contents differ, fail the run.
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from aggregates import DistrictCube
+from benchmarks.synthetic import write_workbook
+from registry import MODULES
+from schema import apply_schema
+from snapshot import CACHE_DIR, prepare_data, read_sheets, validate_raw, workbook_schema
+from tables import multi_response_table, n_pct_csv, render_n_pct_table, single_response_table
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+WORKBOOK_DIR = os.path.join(CACHE_DIR, 'benchmarks')
+# Slowdowns smaller than this are timer noise, whatever the ratio.
+NOISE_SECONDS = 0.05
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def _measure(timings, stage, func, *args, trace_memory=False):
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - started
+    timings[stage] = {'seconds': round(seconds, 4), 'peak_rss_mb': _peak_rss_mb()}
+    if trace_memory:
+        timings[stage]['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return result
+
+
+def _derive(raw, key, mrq_text_dict):
+    schema = workbook_schema(raw, key, mrq_text_dict)
+    validate_raw(raw, key, mrq_text_dict, schema)
+    return apply_schema(prepare_data(raw), schema)
+
+
+def _aggregate(data):
+    cubes = {module.name: module.build(data) for module in MODULES
+             if module.single_cats or module.multi_response}
+    return DistrictCube(data[['District']]), cubes
+
+
+def _render(cubes, rename_dict, mrq_text_dict):
+    digest = hashlib.sha256()
+    tables = 0
+    for name, cube in cubes.items():
+        if hasattr(cube, 'groups'):
+            for prefix in cube.groups:
+                counts, _ = cube.table(prefix)
+                labels = [mrq_text_dict.get(col, rename_dict.get(col, col)) for col in counts.index]
+                title = mrq_text_dict.get(prefix, prefix)
+                columns, rows = multi_response_table(cube, prefix, labels)
+                render_n_pct_table(columns, rows, title)
+                digest.update(n_pct_csv(columns, rows, title))
+                tables += 1
+        else:
+            for var in cube.counts:
+                title = rename_dict.get(var, var)
+                columns, rows = single_response_table(cube, var)
+                render_n_pct_table(columns, rows, title)
+                digest.update(n_pct_csv(columns, rows, title))
+                tables += 1
+    return tables, digest.hexdigest()
+
+
+def run_case(rows, districts, seed=0, workbook_dir=WORKBOOK_DIR, trace_memory=False):
+    """Benchmark one synthetic workbook; it is generated once and reused."""
+    os.makedirs(workbook_dir, exist_ok=True)
+    path = os.path.join(workbook_dir, f'nims-{rows}-{districts}-{seed}.xlsx')
+    if not os.path.exists(path):
+        write_workbook(path + '.tmp.xlsx', rows, districts, seed)
+        os.replace(path + '.tmp.xlsx', path)
+
+    timings = {}
+    raw, key, mrq_text_dict, _ = _measure(timings, 'read', read_sheets, path, trace_memory=trace_memory)
+    data = _measure(timings, 'derive', _derive, raw, key, mrq_text_dict, trace_memory=trace_memory)
+    del raw
+    _, cubes = _measure(timings, 'aggregate', _aggregate, data, trace_memory=trace_memory)
+    rename_dict = dict(zip(key['Variables'], key['TEXT']))
+    tables, checksum = _measure(timings, 'render', _render, cubes, rename_dict, mrq_text_dict,
+                                 trace_memory=trace_memory)
+    return {'rows': rows, 'districts': districts, 'seed': seed,
+            'tables': tables, 'checksum': checksum, 'stages': timings}
+
+
+def case_name(result):
+    return f"{result['rows']}x{result['districts']}/{result['seed']}"
+
+
+def compare(result, baseline, tolerance):
+    """Return regression messages for ``result`` against its baseline entry."""
+    problems = []
+    if baseline['checksum'] != result['checksum']:
+        problems.append('table contents differ from the baseline')
+    for stage, timing in result['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before and timing['seconds'] > max(before['seconds'] * (1 + tolerance),
+                                              before['seconds'] + NOISE_SECONDS):
+            problems.append(f"{stage} took {timing['seconds']:.3f}s (baseline {before['seconds']:.3f}s)")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help='row counts to benchmark (default: 10000 100000)')
+    parser.add_argument('--districts', type=int, nargs='+', default=[3], help='district counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown per stage, as a fraction (default: 0.25)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record per-stage peak allocations with tracemalloc (slow)')
+    parser.add_argument('--workbook-dir', default=WORKBOOK_DIR, help='where generated workbooks are kept')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    failed = False
+    for rows in args.rows:
+        for districts in args.districts:
+            result = run_case(rows, districts, args.seed, args.workbook_dir, args.trace_memory)
+            name = case_name(result)
+            stages = ', '.join(f"{stage} {t['seconds']:.3f}s/{t['peak_rss_mb']:.0f}MB"
+                               for stage, t in result['stages'].items())
+            print(f"{name}: {result['tables']} tables; {stages}")
+            if args.save_baseline:
+                baseline[name] = result
+            elif name in baseline:
+                for problem in compare(result, baseline[name], args.tolerance):
+                    print(f"  REGRESSION {problem}")
+                    failed = True
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
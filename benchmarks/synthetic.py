@@ -0,0 +1,83 @@
+"""Synthetic NIMS-shaped workbooks for benchmarking.
+
+    python -m benchmarks.synthetic bench.xlsx --rows 100000 --districts 6
+
+The Database sheet carries every module single_cats variable, the cb4/AC2
+sources of the derived fields, a submission KEY, design weights and ``_N``
+multi-response groups; the Key and Key_MRQ sheets label them the way the
+real workbook does.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from registry import DERIVED_FIELDS, MODULES
+from schema import WEIGHT_COLUMN
+
+DISTRICT_NAMES = ['Jamshoro', 'Khairpur', 'Lodhran', 'Dadu', 'Rajanpur', 'Thatta', 'Badin',
+                  'Muzaffargarh', 'Umerkot', 'Tharparkar', 'Sanghar', 'Bahawalpur']
+ANSWERS = ['Yes', 'No', "Don't know", 'Refused', 'Not applicable']
+# Multi-response prefix -> number of options.
+MULTI_RESPONSE_GROUPS = {'AC4': 6, 'IF5': 5, 'BC2': 8, 'SB2': 7, 'BF3': 9, 'KC1': 4}
+
+
+def generate(rows, districts=3, seed=0, multi_response_groups=MULTI_RESPONSE_GROUPS):
+    """Return (database, key, key_mrq) frames with ``rows`` interviews."""
+    rng = np.random.default_rng(seed)
+    names = (DISTRICT_NAMES * (districts // len(DISTRICT_NAMES) + 1))[:districts]
+    names = [name if i < len(DISTRICT_NAMES) else f"{name} {i // len(DISTRICT_NAMES) + 1}"
+             for i, name in enumerate(names)]
+
+    columns = {
+        'KEY': [f'uuid:{i:08d}' for i in range(rows)],
+        'District': rng.choice(names, rows),
+        # A few blank or unparseable ages, as in field data.
+        'cb4': np.where(rng.random(rows) < 0.02, 'unknown', rng.integers(0, 12, rows).astype(str)),
+        'AC2': rng.integers(0, 13, rows),
+    }
+    variables = [var for module in MODULES for var in module.single_cats if var not in DERIVED_FIELDS]
+    for var in variables:
+        n_answers = int(rng.integers(2, len(ANSWERS) + 1))
+        columns[var] = rng.choice(ANSWERS[:n_answers], rows)
+    columns['Cluster_Area'] = rng.choice(['Urban', 'Rural'], rows, p=[0.3, 0.7])
+
+    mrq_labels = {}
+    for prefix, n_options in multi_response_groups.items():
+        mrq_labels[prefix] = f'{prefix}: which apply?'
+        picked = rng.random((rows, n_options)) < rng.uniform(0.1, 0.6, n_options)
+        for i in range(n_options):
+            col = f'{prefix}_{i + 1}'
+            columns[col] = picked[:, i].astype(np.int8)
+            mrq_labels[col] = f'{prefix} option {i + 1}'
+
+    columns[WEIGHT_COLUMN] = rng.lognormal(0, 0.3, rows).round(4)
+
+    database = pd.DataFrame(columns)
+    key_vars = variables + list(DERIVED_FIELDS) + ['cb4', 'AC2']
+    key = pd.DataFrame({'Variables': key_vars, 'TEXT': [f'Question {var}' for var in key_vars]})
+    key_mrq = pd.DataFrame({'Variable': list(mrq_labels), 'TEXT': list(mrq_labels.values())})
+    return database, key, key_mrq
+
+
+def write_workbook(path, rows, districts=3, seed=0):
+    database, key, key_mrq = generate(rows, districts, seed)
+    with pd.ExcelWriter(path) as writer:
+        database.to_excel(writer, sheet_name='Database', index=False)
+        key.to_excel(writer, sheet_name='Key', index=False)
+        key_mrq.to_excel(writer, sheet_name='Key_MRQ', index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='workbook to write (.xlsx)')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--districts', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    write_workbook(args.path, args.rows, args.districts, args.seed)
+
+
+if __name__ == '__main__':
+    main()
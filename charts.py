@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+OTHER_LABEL = 'Other'
+
+
+def collapse_other(labels, values, max_categories=None):
+    """Keep the ``max_categories - 1`` largest rows of ``values`` (categories x
+    districts) in their original order and sum the rest into one "Other" row."""
+    labels = pd.Index(labels)
+    if not max_categories or len(labels) <= max_categories:
+        return labels, values
+    order = np.argsort(-values.sum(axis=1), kind='stable')
+    keep, rest = np.sort(order[:max_categories - 1]), order[max_categories - 1:]
+    collapsed = np.vstack([values[keep], values[rest].sum(axis=0, keepdims=True)])
+    return pd.Index(labels[keep].tolist() + [OTHER_LABEL]), collapsed
+
+
+def grouped_bar_figure(labels, districts, values, title, x_title, skip_zero=False, template=None,
+                       legend_title='District', y_title='Count'):
+    """One bar trace per district (or other series) from a categories x
+    districts count array. With ``skip_zero`` zero counts get no bar, and
+    all-zero districts no trace. ``template`` defaults to plotly's default
+    template, which Streamlit sets to its own so that charts take the
+    dashboard theme's colours."""
+    labels = pd.Index(labels)
+    traces = []
+    for i, district in enumerate(districts):
+        y = values[:, i]
+        if skip_zero:
+            shown = y > 0
+            if not shown.any():
+                continue
+            x, y = labels[shown].tolist(), y[shown]
+        else:
+            x = labels.tolist()
+        traces.append(go.Bar(name=str(district), x=x, y=y))
+    return go.Figure(traces, layout=dict(
+        title=dict(text=title),
+        barmode='group',
+        legend=dict(title=dict(text=legend_title)),
+        xaxis=dict(title=dict(text=x_title)),
+        yaxis=dict(title=dict(text=y_title)),
+        template=template,
+    ))
+
+
+def single_response_figure(count_table, var, var_title, max_categories=None, template=None):
+    labels, values = collapse_other(count_table.index, count_table.to_numpy(), max_categories)
+    fig = grouped_bar_figure(labels, count_table.columns, values, var_title, var_title,
+                             skip_zero=True, template=template)
+    fig.update_layout(
+        title={'text': var_title, 'font': {'size': 32}},
+        dragmode=False,  # Disable zooming and panning
+        xaxis=dict(fixedrange=True),  # Disable x-axis zooming
+        yaxis=dict(fixedrange=True)  # Disable y-axis zooming
+    )
+    return fig
+
+
+def crosstab_figure(count_table, row_title, col_title, max_categories=None, template=None):
+    """Grouped bars of a row answer x column answer count table, one series
+    per column answer."""
+    labels, values = collapse_other(count_table.index, count_table.to_numpy(), max_categories)
+    fig = grouped_bar_figure(labels, count_table.columns, values, f"{row_title} by {col_title}", row_title,
+                             skip_zero=True, template=template, legend_title=col_title)
+    fig.update_layout(dragmode=False, xaxis=dict(fixedrange=True), yaxis=dict(fixedrange=True))
+    return fig
+
+
+def multi_response_figure(counts, districts_list, option_labels, main_question, max_categories=None,
+                          template=None):
+    labels, values = collapse_other(option_labels, counts[districts_list].to_numpy(), max_categories)
+    return grouped_bar_figure(labels, districts_list, values, main_question, 'Option', template=template)
+
+
+def comparison_figure(categories, shares, rounds, var_title, template=None):
+    """Side-by-side % of each category in each survey round; ``shares`` is
+    categories x rounds."""
+    fig = grouped_bar_figure(categories, rounds, shares, var_title, var_title, template=template,
+                             legend_title='Round', y_title='%')
+    fig.update_layout(dragmode=False, xaxis=dict(fixedrange=True), yaxis=dict(fixedrange=True))
+    return fig
+
+
+class Chart:
+    """A cached figure and its JSON, serialised at most once. st.plotly_chart
+    is handed the figure: given a dict it would validate it into a new
+    Figure on every call."""
+
+    def __init__(self, figure):
+        self.figure = figure
+        self._json = None
+
+    def json(self):
+        if self._json is None:
+            self._json = self.figure.to_json()
+        return self._json
@@ -0,0 +1,81 @@
+"""Baseline vs endline: a second survey round aligned to the endline schema.
+
+The baseline workbook is loaded and snapshotted like the endline one, then
+projected once onto the endline schema; its module cubes are built lazily
+and cached like any Workbook's, so a comparison only reads two cached count
+tables.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+from schema import answer_code
+from store import Workbook
+
+ROUND_LABELS = ('Baseline', 'Endline')
+
+
+def _label_kind(values):
+    labels = values.cat.categories if isinstance(values.dtype, CategoricalDtype) else values.dropna()
+    return 'number' if pd.api.types.is_numeric_dtype(labels) else 'text'
+
+
+def align_round(other, endline):
+    """``other`` (a Workbook of another round) with only the columns of the
+    endline schema, answers coded as numbers in one round and text in the
+    other compared as text codes."""
+    columns = {}
+    for col, kind in endline.schema.items():
+        if col not in other.data.columns:
+            continue
+        values = other.data[col]
+        if kind == 'category' and _label_kind(values) != _label_kind(endline.data[col]):
+            values = values.map(answer_code, na_action='ignore').astype('category')
+        columns[col] = values
+    data = pd.DataFrame(columns, index=other.data.index)
+    return Workbook(other.version, data, other.key, other.mrq_text_dict, other.mrq_error, endline.schema)
+
+
+def _by_code(count_table):
+    # A blank in one round makes its codes floats (1.0) where the other
+    # round has ints (1); both are counted under the code "1".
+    return count_table.groupby(count_table.index.map(answer_code), sort=False).sum()
+
+
+def _shares(count_table, categories, districts):
+    counts = count_table.reindex(index=categories, columns=districts, fill_value=0)
+    counts['Total'] = counts.sum(axis=1)
+    bases = counts.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = counts.to_numpy() / bases.to_numpy() * 100
+    return shares, bases.to_numpy()
+
+
+def comparison_table(baseline_cube, endline_cube, var, selected=None):
+    """Return (columns, rows, shares): per selected district and in total,
+    each category's baseline and endline % and their change in percentage
+    points; ``shares`` is the (categories x columns x rounds) % array."""
+    after = _by_code(endline_cube.table(var, selected))
+    if var in baseline_cube.counts:
+        before = _by_code(baseline_cube.table(var, selected))
+    else:
+        before = pd.DataFrame(index=after.index[:0], columns=after.columns[:0], dtype=np.int64)
+    categories = list(dict.fromkeys(list(after.index) + list(before.index)))
+    districts = sorted(set(after.columns) | set(before.columns))
+
+    before_shares, before_bases = _shares(before, categories, districts)
+    after_shares, after_bases = _shares(after, categories, districts)
+    before_cells = np.where(before_bases > 0, np.char.mod('%.1f%%', np.nan_to_num(before_shares)), '–')
+    after_cells = np.where(after_bases > 0, np.char.mod('%.1f%%', np.nan_to_num(after_shares)), '–')
+    change = after_shares - before_shares
+    change_cells = np.where(np.isnan(change), '–', np.char.mod('%+.1f pp', np.nan_to_num(change)))
+
+    rows = []
+    for i, category in enumerate(categories):
+        cells = np.column_stack([before_cells[i], after_cells[i], change_cells[i]]).ravel()
+        rows.append([category] + list(cells))
+    total_row = ['Total']
+    for before_n, after_n in zip(before_bases, after_bases):
+        total_row.extend([f"N={before_n}", f"N={after_n}", ""])
+    rows.append(total_row)
+    return districts + ['Total'], rows, np.stack([before_shares, after_shares], axis=2)
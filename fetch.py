@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from snapshot import CACHE_DIR
+
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = (10, 60)  # (connect, read) seconds
+RETRIES = 4
+BACKOFF = 1.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_fetch_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    pass
+
+
+def get_session():
+    # One pooled session per process, shared by every rerun and user.
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, payload):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as fh:
+        json.dump(payload, fh)
+    os.replace(tmp_path, path)
+
+
+def _download(session, url, meta, part_path, part_meta_path, timeout):
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # Resume an interrupted download only if it is for the same remote version.
+    part_meta = _read_json(part_meta_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = part_meta.get("etag") or part_meta.get("last_modified")
+    if offset and part_meta.get("url") == url and validator:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        if offset and response.status_code >= 400 and response.status_code not in RETRY_STATUSES:
+            # The partial file cannot be resumed (416 once it is already
+            # complete, or the source refusing the Range): start it over.
+            for stale in (part_path, part_meta_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            response.close()
+            return _download(session, url, meta, part_path, part_meta_path, timeout)
+        if response.status_code in RETRY_STATUSES:
+            raise requests.HTTPError(f"{response.status_code} from source", response=response)
+        response.raise_for_status()
+
+        remote = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if response.status_code != 206:
+            offset = 0
+        _write_json(part_meta_path, remote)
+
+        with open(part_path, "ab" if offset else "wb") as fh:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                fh.write(chunk)
+    return remote
+
+
+def fetch_source(url, cache_dir=CACHE_DIR, session=None, timeout=TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF):
+    """Mirror ``url`` to a local file and return (path, sha256, changed).
+
+    Sends If-None-Match/If-Modified-Since from the previous download so an
+    unchanged source costs a single round-trip, streams the body to disk in
+    chunks, and resumes a partial file with a Range request after a failure.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "source.xlsx")
+    meta_path = os.path.join(cache_dir, "source.json")
+    part_path = f"{path}.part"
+    part_meta_path = f"{part_path}.json"
+    session = session or get_session()
+
+    with _fetch_lock:
+        meta = _read_json(meta_path)
+        if meta.get("url") != url or not os.path.exists(path):
+            meta = {}
+        return _fetch(session, url, meta, path, meta_path, part_path, part_meta_path,
+                      timeout, retries, backoff)
+
+
+def _fetch(session, url, meta, path, meta_path, part_path, part_meta_path,
+           timeout, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            remote = _download(session, url, meta, part_path, part_meta_path, timeout)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                requests.exceptions.ChunkedEncodingError) as e:
+            status = getattr(e.response, "status_code", None)
+            if status is not None and status not in RETRY_STATUSES:
+                raise FetchError(f"Download failed: {e}") from e
+            if attempt == retries:
+                raise FetchError(f"Download failed after {retries + 1} attempts: {e}") from e
+            time.sleep(backoff * 2 ** attempt)
+
+    if remote is None:
+        return path, meta["sha256"], False
+
+    digest = file_hash(part_path)
+    os.replace(part_path, path)
+    os.remove(part_meta_path)
+    _write_json(meta_path, dict(remote, sha256=digest))
+    return path, digest, digest != meta.get("sha256")
@@ -0,0 +1,176 @@
+"""Headline indicators declared as numerator/denominator conditions.
+
+An indicator is the share of interviews meeting every ``numerator``
+condition among those meeting every ``denominator`` condition. evaluate()
+compiles a whole list of them: each distinct condition is computed once
+over the frame, and every numerator and denominator is then counted per
+district in one pass over row blocks.
+
+``equals`` names answers by their label; when the Key sheet lists codes
+("1=Yes; 2=No") a code matches through its label. An indicator whose
+answers match nothing in the data is reported as unmatched, not as 0%.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from schema import answer_code
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ROWS = 1 << 16
+
+
+def answered(col):
+    return ('answered', col, None)
+
+
+def equals(col, *values):
+    return ('in', col, frozenset(answer_code(value) for value in values))
+
+
+def at_least(col, value):
+    return ('>=', col, value)
+
+
+def at_most(col, value):
+    return ('<=', col, value)
+
+
+class Indicator:
+    """``label`` defaults to the Key sheet text of the first numerator
+    question and the answers it counts."""
+
+    def __init__(self, key, label, numerator, denominator=()):
+        self.key = key
+        self.label = label
+        self.numerator = list(numerator)
+        # Interviews that answered the numerator's questions, unless stated.
+        self.denominator = list(denominator) or [answered(col) for col in
+                                                 dict.fromkeys(cond[1] for cond in self.numerator)]
+
+    def columns(self):
+        return {cond[1] for cond in self.numerator + self.denominator}
+
+    def title(self, question_texts):
+        if self.label:
+            return self.label
+        kind, col, value = self.numerator[0]
+        answers = ', '.join(sorted(map(str, value))) if kind == 'in' else f"{kind} {value}"
+        return f"{question_texts.get(col, col)}: {answers}"
+
+
+# AC2 is the number of ANC visits (AC2_new bins it at "8 and above"). The
+# other questions are titled from the Key sheet, counting its "Yes" answer
+# among those who answered.
+INDICATORS = [
+    Indicator("anc_1", "At least one ANC visit", [at_least('AC2', 1)]),
+    Indicator("anc_4", "At least 4 ANC visits", [at_least('AC2', 4)]),
+    Indicator("anc_8", "8 or more ANC visits", [at_least('AC2', 8)]),
+    Indicator("if1", None, [equals('IF1', 'Yes')]),
+    Indicator("if2", None, [equals('IF2', 'Yes')]),
+    Indicator("bf1", None, [equals('BF1', 'Yes')]),
+    Indicator("bf2", None, [equals('BF2', 'Yes')]),
+    Indicator("sb1", None, [equals('SB1', 'Yes')]),
+]
+
+
+def _matches(answers, value, labels):
+    codes = [answer_code(answer) for answer in answers]
+    return np.array([code in value or labels.get(code) in value for code in codes], dtype=bool)
+
+
+def _condition(data, cond, numeric, code_labels):
+    """The condition's mask over ``data``, and whether an ``equals``
+    condition matched any answer present."""
+    kind, col, value = cond
+    values = data[col]
+    if kind == 'answered':
+        return values.notna().to_numpy(), True
+    if kind == 'in':
+        labels = code_labels.get(col, {})
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Compare the few categories, then look the answer up by code.
+            matches = _matches(values.cat.categories, value, labels)
+            return np.append(matches, False)[values.cat.codes.to_numpy()], matches.any()
+        answers = pd.unique(values.dropna())
+        matches = _matches(answers, value, labels)
+        return values.isin(answers[matches]).to_numpy(), matches.any()
+    if col not in numeric:
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = pd.to_numeric(pd.Series(values.cat.categories), errors='coerce').to_numpy(float)
+            numeric[col] = np.append(categories, np.nan)[values.cat.codes.to_numpy()]
+        else:
+            numeric[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        return (numeric[col] >= value if kind == '>=' else numeric[col] <= value), True
+
+
+def evaluate(indicators, data, code_labels=None):
+    """Return (districts, numerators, denominators, unmatched): the districts
+    with interviews, two (districts x indicators) count arrays, and the keys
+    of indicators whose answers match nothing in ``data`` (or that use a
+    column it lacks). ``code_labels`` is key_code_labels() of the Key sheet."""
+    usable = [ind for ind in indicators if ind.columns() <= set(data.columns)]
+    conditions = list(dict.fromkeys(cond for ind in usable for cond in ind.numerator + ind.denominator))
+    position = {cond: i + 1 for i, cond in enumerate(conditions)}
+    numeric = {}
+    # One row per condition (row 0 is always true), one column per interview.
+    matrix = np.ones((len(conditions) + 1, len(data)), dtype=bool)
+    unmatched_conditions = set()
+    for cond, i in position.items():
+        matrix[i], matched = _condition(data, cond, numeric, code_labels or {})
+        if not matched:
+            unmatched_conditions.add(cond)
+
+    # Every numerator and denominator as a row of condition positions,
+    # padded with the always-true row, so all are ANDed at once.
+    terms = [ind.numerator + ind.denominator for ind in usable] + [ind.denominator for ind in usable]
+    width = max((len(term) for term in terms), default=1)
+    index = np.zeros((len(terms), width), dtype=np.intp)
+    for row, term in enumerate(terms):
+        index[row, :len(term)] = [position[cond] for cond in term]
+
+    district_codes, districts = pd.factorize(data['District'], sort=True)
+    counts = np.zeros((len(terms), len(districts)))
+    for start in range(0, len(data), BLOCK_ROWS):
+        block = matrix[:, start:start + BLOCK_ROWS]
+        met = block[index[:, 0]]
+        for i in range(1, width):
+            met &= block[index[:, i]]
+        codes = district_codes[start:start + BLOCK_ROWS]
+        onehot = np.zeros((len(codes), len(districts)), dtype=np.float32)
+        kept = codes >= 0
+        onehot[np.flatnonzero(kept), codes[kept]] = 1
+        counts += met.astype(np.float32) @ onehot
+    counts = counts.T
+
+    numerators = np.zeros((len(districts), len(indicators)), dtype=np.int64)
+    denominators = np.zeros_like(numerators)
+    columns = [indicators.index(ind) for ind in usable]
+    numerators[:, columns] = counts[:, :len(usable)].round()
+    denominators[:, columns] = counts[:, len(usable):].round()
+    unmatched = [ind.key for ind in indicators
+                 if ind not in usable or unmatched_conditions.intersection(ind.numerator + ind.denominator)]
+    if unmatched:
+        logger.warning("Indicators matching no answers in the data: %s", ", ".join(unmatched))
+    return list(districts), numerators, denominators, unmatched
+
+
+def indicator_table(indicators, evaluated, selected=None, question_texts=None):
+    """Return (columns, rows) of indicator %s and denominators per selected
+    district and in total, for render_n_pct_table with ('%', 'N') columns.
+    Unmatched indicators show "–" rather than 0%."""
+    districts, numerators, denominators, unmatched = evaluated
+    keep = [i for i, district in enumerate(districts) if not selected or district in selected]
+    num = np.column_stack([numerators[keep].T, numerators[keep].sum(axis=0)])
+    den = np.column_stack([denominators[keep].T, denominators[keep].sum(axis=0)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = num / den * 100
+    cells = np.where(den > 0, np.char.mod('%.1f%%', np.nan_to_num(share)), '–')
+    cells[[ind.key in unmatched for ind in indicators]] = '–'
+    rows = []
+    for ind, row_cells, row_den in zip(indicators, cells, den):
+        rows.append([ind.title(question_texts or {})] + [item for pair in zip(row_cells, row_den) for item in pair])
+    return [districts[i] for i in keep] + ['Total'], rows
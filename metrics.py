@@ -0,0 +1,135 @@
+"""Process-wide timing spans, payload sizes and cache counters.
+
+Off by default: every call returns straight away (``span`` hands back a
+shared null context) until ``configure(enabled=True)``. When on, totals are
+kept in memory for the admin panel and each event is appended to an
+optional JSON-lines log.
+"""
+import contextlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+_NULL_SPAN = contextlib.nullcontext()
+
+_lock = threading.Lock()
+_enabled = False
+_log_path = None
+_log = None
+# name -> [count, total, max]; seconds for spans, bytes for payloads.
+_spans = defaultdict(lambda: [0, 0.0, 0.0])
+_payloads = defaultdict(lambda: [0, 0, 0])
+_counters = defaultdict(int)
+_recent = deque(maxlen=200)
+
+
+def configure(enabled, log_path=None):
+    global _enabled, _log_path, _log
+    with _lock:
+        _enabled = bool(enabled)
+        if log_path != _log_path:
+            if _log is not None:
+                _log.close()
+            _log = open(log_path, "a", buffering=1, encoding="utf-8") if log_path else None
+            _log_path = log_path
+
+
+def enabled():
+    return _enabled
+
+
+def _emit(event):
+    # Called with _lock held.
+    _recent.append(event)
+    if _log is not None:
+        _log.write(json.dumps(event, default=str) + "\n")
+
+
+def _add(stats, value):
+    stats[0] += 1
+    stats[1] += value
+    stats[2] = max(stats[2], value)
+
+
+def record_span(name, seconds, **fields):
+    if not _enabled:
+        return
+    with _lock:
+        _add(_spans[name], seconds)
+        _emit({"ts": time.time(), "type": "span", "name": name, "ms": round(seconds * 1000, 3), **fields})
+
+
+class _Span:
+    __slots__ = ("name", "fields", "started")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, time.perf_counter() - self.started, **self.fields)
+        return False
+
+
+def span(name, **fields):
+    """Time a ``with`` block under ``name``; ``fields`` only go to the log."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+
+def count(name, n=1, **fields):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+        _emit({"ts": time.time(), "type": "count", "name": name, "n": n, **fields})
+
+
+def payload(name, size, **fields):
+    """Record the size of something sent to the browser. ``size`` may be a
+    callable so that costly measurements are skipped while disabled."""
+    if not _enabled:
+        return
+    if callable(size):
+        size = size()
+    with _lock:
+        _add(_payloads[name], size)
+        _emit({"ts": time.time(), "type": "payload", "name": name, "bytes": size, **fields})
+
+
+def cache_lookup(name, hit, **fields):
+    count(f"cache.{name}.{'hit' if hit else 'miss'}", **fields)
+
+
+def summary():
+    """Copies of the running totals, for display."""
+    with _lock:
+        spans = {name: {"count": n, "total_ms": round(total * 1000, 1),
+                        "mean_ms": round(total * 1000 / n, 2), "max_ms": round(peak * 1000, 1)}
+                 for name, (n, total, peak) in _spans.items()}
+        payloads = {name: {"count": n, "total_kb": round(total / 1024, 1),
+                           "mean_kb": round(total / 1024 / n, 1), "max_kb": round(peak / 1024, 1)}
+                    for name, (n, total, peak) in _payloads.items()}
+        counters = dict(_counters)
+        recent = list(_recent)
+    caches = {}
+    for name, n in counters.items():
+        if name.startswith("cache.") and name.endswith((".hit", ".miss")):
+            cache, outcome = name[len("cache."):].rsplit(".", 1)
+            caches.setdefault(cache, {"hit": 0, "miss": 0})[outcome] = n
+    return {"spans": spans, "payloads": payloads, "counters": counters,
+            "caches": caches, "recent": recent}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _payloads.clear()
+        _counters.clear()
+        _recent.clear()
@@ -0,0 +1,96 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from aggregates import CountCube, MultiResponseCube
+
+
+def derive_cb4_class(data):
+    bins = [-1, 3, 7, 11]
+    labels = ['0 - 3 Months', '4 - 7 Months', '8 - 11 Months']
+    return pd.cut(data['cb4'], bins=bins, labels=labels)
+
+
+def derive_ac2_new(data):
+    ac2 = data['AC2']
+    return pd.Series(np.where(ac2 >= 8, '8 and above', ac2.astype(str)), index=data.index)
+
+
+# Derived field -> (source columns, derivation).
+DERIVED_FIELDS = {
+    'cb4_class': (['cb4'], derive_cb4_class),
+    'AC2_new': (['AC2'], derive_ac2_new),
+}
+
+
+def ensure_derived(data, fields):
+    missing = [field for field in fields
+               if field in DERIVED_FIELDS and field not in data.columns]
+    if not missing:
+        return data
+    data = data.copy()
+    for field in missing:
+        data[field] = DERIVED_FIELDS[field][1](data)
+    return data
+
+
+def find_multi_select_groups(columns):
+    multi_select_groups = {}
+    for col in columns:
+        match = re.match(r"(.*)_(\d+)$", str(col))
+        if match:
+            prefix = match.group(1)
+            multi_select_groups.setdefault(prefix, []).append(col)
+    return multi_select_groups
+
+
+class Module:
+    """A dashboard page: which columns it reads and how its aggregates are built."""
+
+    def __init__(self, name, key, single_cats=(), multi_response=False):
+        self.name = name
+        self.key = key
+        self.single_cats = list(single_cats)
+        self.multi_response = multi_response
+
+    def columns(self, available):
+        """Columns of ``available`` this module needs, including the sources of
+        any derived fields that are not already materialised."""
+        if self.multi_response:
+            needed = [col for cols in find_multi_select_groups(available).values() for col in cols]
+        else:
+            needed = []
+            for var in self.single_cats:
+                if var in available:
+                    needed.append(var)
+                elif var in DERIVED_FIELDS:
+                    needed.extend(DERIVED_FIELDS[var][0])
+        return list(dict.fromkeys(['District'] + [col for col in needed if col in available]))
+
+    def build(self, data):
+        frame = data[self.columns(data.columns)]
+        if self.multi_response:
+            return MultiResponseCube(frame, find_multi_select_groups(frame.columns))
+        return CountCube(ensure_derived(frame, self.single_cats), self.single_cats)
+
+
+MODULES = [
+    Module("EXECUTIVE SUMMARY", "Executive_Summary"),
+    Module("Module : Basic Information", "Basic_Info", ['Cluster_Area','MB3','MB4', 'MB5']),
+    Module("BACKGROUND MODULE: INFANT/CHILD", "Background_Child", ['cb2','cb4_class']),
+    Module("MODULE 1: ANC", "ANC", ['AC1','AC2_new', 'AC5','AC7']),
+    Module("MODULE 2: IRON/IRON AND FOLIC ACID CONTAINING SUPPLEMENTS", "Iron_Supplement", ['IF1','IF2']),
+    Module("MODULE 3: IFA BCI", "IFA_BCI", ['BC1','BC4', 'BC40']),
+    Module("MODULE 4: SKILLED BIRTH ATTENDANCE & CARE POST-DELIVERY", "SBA_Care",
+           ['SB1','SB1_A1','SB1_A2','SB1_A3','SB3','SB4','SB5']),
+    Module("MODULE 5: BREAST FEEDING", "BreastFeeding", ['BF1','BF2','BF4','BF6','BF8','BF9']),
+    Module("MODULE 6: COUNSELLING IYCF", "Counselling_IYCF", ['CL1']),
+    Module("MODULE 7: BENEFICIARY KNOWLEDGE – BREAST FEEDING", "Beneficiary_Knowledge_BF", ['BKB1','BKB2']),
+    Module("MODULE 8: KANGAROO CARE", "KangarooCare", ['KC2','KC3','KC4','KC5','KC6','KC8']),
+    Module("MODULE 9: WORK AND TIME USAGE QUESTIONS", "Work_Time", ['WT1','WT8']),
+    Module("MODULE 10: New Gender questions for endline", "Endline_Gender",
+           ['GE1','GE2','GE3','GE4','GE5_A','GE5_B','GE5_C','GE5_D','GE5_E']),
+    Module("Analysis of Multi-Response Variables", "Multi_Response", multi_response=True),
+]
+MODULES_BY_NAME = {module.name: module for module in MODULES}
@@ -0,0 +1,157 @@
+"""Render every module's tables and charts to files without Streamlit.
+
+    python report.py workbook.xlsx --out reports --district-subsets --jobs 4
+
+Uses the same module registry, aggregates and table/chart builders as the
+dashboard, so the files match what the pages show. Needs no secrets or
+network access.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from artifacts import question_title
+from charts import multi_response_figure, single_response_figure
+from fetch import file_hash
+from registry import MODULES, MODULES_BY_NAME
+from snapshot import CACHE_DIR, load_workbook
+from tables import multi_response_table, n_pct_csv, render_n_pct_table, single_response_table
+
+# Its own directory under the app's cache: writing a snapshot prunes the
+# others in the same directory, which would include the dashboard's.
+REPORT_CACHE_DIR = os.path.join(CACHE_DIR, "reports")
+
+_workbook = None
+
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9_.+-]+', '_', str(text)).strip('_') or 'untitled'
+
+
+def _load(path, cache_dir):
+    global _workbook
+    if _workbook is None:
+        data, key, mrq_text_dict, _ = load_workbook(path, file_hash(path), cache_dir)
+        rename_dict = dict(zip(key['Variables'], key['TEXT']))
+        _workbook = data, rename_dict, mrq_text_dict
+    return _workbook
+
+
+def _write_outputs(out_dir, name, title, columns, rows, make_figure, chart_format):
+    with open(os.path.join(out_dir, f"{name}_table.csv"), "wb") as fh:
+        fh.write(n_pct_csv(columns, rows, title))
+    with open(os.path.join(out_dir, f"{name}_table.html"), "w", encoding="utf-8") as fh:
+        fh.write(render_n_pct_table(columns, rows, title))
+    if chart_format == "html":
+        make_figure().write_html(os.path.join(out_dir, f"{name}_chart.html"), include_plotlyjs="cdn")
+    elif chart_format != "none":
+        make_figure().write_image(os.path.join(out_dir, f"{name}_chart.{chart_format}"))
+
+
+def render_module(path, cache_dir, module_name, subsets, out_dir, chart_format):
+    """Write one module's outputs for every district subset; return timings."""
+    data, rename_dict, mrq_text_dict = _load(path, cache_dir)
+    module = MODULES_BY_NAME[module_name]
+
+    started = time.perf_counter()
+    cube = module.build(data)
+    aggregated = time.perf_counter()
+    files = 0
+    for subset in subsets:
+        selected = list(subset) if subset else None
+        subset_dir = os.path.join(out_dir, _slug("+".join(subset)) if subset else "All_Districts", module.key)
+        os.makedirs(subset_dir, exist_ok=True)
+        if module.multi_response:
+            for prefix in cube.groups:
+                counts, bases = cube.table(prefix, selected)
+                districts_list = list(bases.index[:-1])
+                if not districts_list:
+                    continue
+                main_question = question_title(prefix, mrq_text_dict, rename_dict)
+                option_labels = [question_title(col, mrq_text_dict, rename_dict) for col in counts.index]
+                columns, rows = multi_response_table(cube, prefix, option_labels, selected)
+                _write_outputs(subset_dir, _slug(prefix), main_question, columns, rows,
+                               lambda: multi_response_figure(counts, districts_list, option_labels, main_question),
+                               chart_format)
+                files += 1
+        else:
+            for var in module.single_cats:
+                if var not in cube.counts:
+                    continue
+                var_title = question_title(var, mrq_text_dict, rename_dict)
+                columns, rows = single_response_table(cube, var, selected)
+                _write_outputs(subset_dir, _slug(var), var_title, columns, rows,
+                               lambda: single_response_figure(cube.table(var, selected), var, var_title),
+                               chart_format)
+                files += 1
+    finished = time.perf_counter()
+    return {
+        "module": module.name,
+        "aggregate_seconds": round(aggregated - started, 4),
+        "render_seconds": round(finished - aggregated, 4),
+        "tables": files,
+    }
+
+
+def district_subsets(districts, all_subsets):
+    if not all_subsets:
+        return [()]  # every district, written to All_Districts
+    return [combo for size in range(1, len(districts) + 1)
+            for combo in itertools.combinations(districts, size)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workbook", help="path to the survey workbook (.xlsx)")
+    parser.add_argument("--out", default="reports", help="output directory (default: reports)")
+    parser.add_argument("--modules", nargs="+", metavar="KEY",
+                        help="module keys to render, e.g. ANC Work_Time (default: all)")
+    parser.add_argument("--district-subsets", action="store_true",
+                        help="render every non-empty combination of districts, not just all of them")
+    parser.add_argument("--charts", default="html", choices=["html", "png", "svg", "none"],
+                        help="chart file format; png/svg need the kaleido package (default: html)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--cache-dir", default=REPORT_CACHE_DIR,
+                        help="snapshot cache directory (default: a reports directory in the app's cache)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    data, _, _ = _load(args.workbook, args.cache_dir)
+    loaded = time.perf_counter()
+    districts = sorted(data['District'].dropna().unique())
+    subsets = district_subsets(districts, args.district_subsets)
+
+    modules = [module for module in MODULES if module.single_cats or module.multi_response]
+    if args.modules:
+        modules = [module for module in modules if module.key in args.modules]
+
+    timings = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(render_module, args.workbook, args.cache_dir, module.name,
+                               subsets, args.out, args.charts) for module in modules]
+        for future in as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            print(f"{timing['module']}: {timing['tables']} tables, aggregate "
+                  f"{timing['aggregate_seconds']:.3f}s, render {timing['render_seconds']:.3f}s")
+
+    summary = {
+        "workbook": args.workbook,
+        "district_subsets": len(subsets),
+        "load_seconds": round(loaded - started, 4),
+        "total_seconds": round(time.perf_counter() - started, 4),
+        "modules": sorted(timings, key=lambda t: [m.name for m in modules].index(t["module"])),
+    }
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "timings.json"), "w") as fh:
+        json.dump(summary, fh, indent=2)
+    print(f"Loaded in {summary['load_seconds']:.3f}s; finished in {summary['total_seconds']:.3f}s "
+          f"({len(subsets)} district subset(s)) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
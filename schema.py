@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from registry import DERIVED_FIELDS, MODULES, find_multi_select_groups
+
+# Survey design: interview weights and the clusters (within each district)
+# used for weighted estimates and their standard errors.
+WEIGHT_COLUMN = os.environ.get("MNHN_WEIGHT_COLUMN", "weight")
+CLUSTER_COLUMN = os.environ.get("MNHN_CLUSTER_COLUMN", "Cluster_Area")
+
+# Used arithmetically; cb4 and AC2 are also coerced to numbers in prepare_data.
+NUMERIC_COLUMNS = ['cb4', 'AC2', WEIGHT_COLUMN]
+# Kept even when neither Key sheet mentions them.
+KEEP_COLUMNS = ['District', CLUSTER_COLUMN]
+# Numeric answers with at most this many distinct codes become categorical.
+MAX_NUMERIC_CATEGORIES = 255
+
+
+def build_schema(columns, key, mrq_variables):
+    """Map each column worth keeping to 'category', 'indicator' or 'numeric'.
+
+    Survey answers are the variables named in the Key and Key_MRQ sheets and
+    the module single_cats; ``_N`` columns are multi-response indicators.
+    Anything else is projected away at load.
+    """
+    indicators = {col for cols in find_multi_select_groups(columns).values() for col in cols}
+    answers = set(key['Variables'].dropna()) | set(mrq_variables)
+    for module in MODULES:
+        answers.update(module.single_cats)
+    for sources, _ in DERIVED_FIELDS.values():
+        answers.update(sources)
+
+    schema = {}
+    for col in columns:
+        if col in NUMERIC_COLUMNS:
+            schema[col] = 'numeric'
+        elif col in indicators:
+            schema[col] = 'indicator'
+        elif col in answers or col in KEEP_COLUMNS:
+            schema[col] = 'category'
+    return schema
+
+
+def answer_code(value):
+    """One form for an answer code: 1, 1.0, np.int8(1) and "1" are all "1"."""
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) and float(value).is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _as_category(values):
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        if values.nunique() > MAX_NUMERIC_CATEGORIES:
+            return values
+    elif values.dtype == object:
+        # Mixed numbers and text cannot share one set of sorted categories.
+        kinds = values.dropna().map(type).unique()
+        if len(kinds) > 1:
+            values = values.where(values.isna(), values.astype(str))
+    return values.astype('category')
+
+
+def _as_indicator(values):
+    # 0/1 answers lose nothing as uint8: blanks and text never count as
+    # selected and add nothing to the "any selected" base.
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.dropna().isin([0, 1]).all():
+        return numeric.fillna(0).astype(np.uint8)
+    return numeric
+
+
+def apply_schema(data, schema):
+    columns = {}
+    for col, kind in schema.items():
+        values = data[col]
+        if kind == 'category':
+            values = _as_category(values)
+        elif kind == 'indicator':
+            values = _as_indicator(values)
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        columns[col] = values
+    return pd.DataFrame(columns, index=data.index)
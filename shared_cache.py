@@ -0,0 +1,264 @@
+"""Cache tier shared by every replica of the dashboard.
+
+It holds the published data version, the prepared dataset of that version
+and its module aggregates, under keys that carry the snapshot format and the
+data version. A sync on any replica publishes a new version, which the
+others pick up on their next rerun; a lock held in the same store lets only
+one replica at a time fetch and parse the source.
+
+Backends: process memory (the default, for a single replica), a directory on
+shared storage, or Redis. FileRedis keeps the subset of the Redis client API
+used here in a SQLite file, as a stand-in where no Redis server runs.
+"""
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from registry import MODULES
+from snapshot import SNAPSHOT_VERSION
+
+# A replica that dies mid-refresh holds the lock at most this long.
+LOCK_TTL = 600
+LOCK_POLL = 0.5
+# Entries of superseded versions are deleted on publish; the TTL only
+# catches what a crashed replica left behind.
+ENTRY_TTL = 7 * 24 * 3600
+
+
+class MemoryBackend:
+    """Objects kept as they are, for the replicas of a single process."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, None if ttl is None else time.time() + ttl)
+
+    def add(self, key, value, ttl=None):
+        """Set ``key`` unless it is already set; return whether it was."""
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._entries[key] = (value, None if ttl is None else time.time() + ttl)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class DirectoryBackend:
+    """Pickled entries, one file per key, in a directory every replica mounts."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.path, key.replace(os.sep, "_").replace(":", "_"))
+
+    def _write_temp(self, value, ttl):
+        tmp_path = os.path.join(self.path, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp_path, "wb") as fh:
+            pickle.dump((None if ttl is None else time.time() + ttl, value), fh,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        return tmp_path
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as fh:
+                expires, value = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def get(self, key):
+        return self._read(self._path(key))
+
+    def set(self, key, value, ttl=None):
+        os.replace(self._write_temp(value, ttl), self._path(key))
+
+    def add(self, key, value, ttl=None):
+        # A hard link cannot replace an existing file, so only one replica
+        # creates the entry, and it is complete as soon as it is visible.
+        path = self._path(key)
+        tmp_path = self._write_temp(value, ttl)
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, path)
+                    return True
+                except FileExistsError:
+                    if self._read(path) is not None:
+                        return False
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path)  # expired
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def delete(self, *keys):
+        for key in keys:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(key))
+
+
+class RedisBackend:
+    """Pickled entries in Redis, or in anything with its get/set/delete API."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                                    ex=ttl, nx=True))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+
+class FileRedis:
+    """get/set/delete with Redis semantics (``ex`` expiry, ``nx``), stored in
+    a SQLite file that several processes can share."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries "
+                       "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def get(self, name):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                             (name, time.time())).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, name, value, ex=None, nx=False):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE key = ? AND expires <= ?", (name, now))
+            if nx and db.execute("SELECT 1 FROM entries WHERE key = ?", (name,)).fetchone():
+                return None
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                       (name, value, None if ex is None else now + ex))
+        return True
+
+    def delete(self, *names):
+        with self._connect() as db:
+            return sum(db.execute("DELETE FROM entries WHERE key = ?", (name,)).rowcount for name in names)
+
+
+def backend_from_url(url):
+    """``memory://`` (or nothing), ``file:///shared/dir`` (or a plain path),
+    ``redis://host:6379/0`` / ``rediss://...``, or ``redis+file:///path.db``
+    for FileRedis."""
+    if not url or url == "memory://":
+        return MemoryBackend()
+    parsed = urlparse(url)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("A redis:// shared cache needs the redis package") from e
+        return RedisBackend(redis.Redis.from_url(url))
+    if parsed.scheme == "redis+file":
+        return RedisBackend(FileRedis(parsed.path))
+    if parsed.scheme in ("", "file"):
+        return DirectoryBackend(parsed.path)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+class SharedCache:
+    """The published version of one workbook (``namespace``) and its
+    dataset and module cubes, in ``backend``."""
+
+    def __init__(self, backend=None, namespace="endline"):
+        self.backend = backend or MemoryBackend()
+        self.prefix = f"mnhn:v{SNAPSHOT_VERSION}:{namespace}:"
+
+    def current_version(self):
+        return self.backend.get(self.prefix + "current")
+
+    def snapshot(self, version):
+        return self.backend.get(f"{self.prefix}data:{version}")
+
+    def cube(self, version, module_name):
+        return self.backend.get(f"{self.prefix}cube:{version}:{module_name}")
+
+    def put_cube(self, version, module_name, cube):
+        self.backend.set(f"{self.prefix}cube:{version}:{module_name}", cube, ENTRY_TTL)
+
+    def publish(self, version, snapshot, cubes=None):
+        """Make ``version`` the one every replica loads, dropping the
+        entries of the version it replaces."""
+        previous = self.current_version()
+        if previous == version:
+            return
+        self.backend.set(f"{self.prefix}data:{version}", snapshot, ENTRY_TTL)
+        for module_name, cube in (cubes or {}).items():
+            self.put_cube(version, module_name, cube)
+        self.backend.set(self.prefix + "current", version)
+        if previous is not None:
+            self.backend.delete(f"{self.prefix}data:{previous}",
+                                *(f"{self.prefix}cube:{previous}:{module.name}" for module in MODULES))
+
+    @contextlib.contextmanager
+    def single_flight(self, name, timeout=LOCK_TTL):
+        """Yield True to the one caller (across replicas) that gets to run
+        ``name``; others wait until it finishes and get False."""
+        key = f"{self.prefix}lock:{name}"
+        token = uuid.uuid4().hex
+        if self.backend.add(key, token, LOCK_TTL):
+            try:
+                yield True
+            finally:
+                if self.backend.get(key) == token:
+                    self.backend.delete(key)
+            return
+        deadline = time.monotonic() + timeout
+        while self.backend.get(key) is not None and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+        yield False
@@ -0,0 +1,213 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import metrics
+from registry import DERIVED_FIELDS, ensure_derived
+from schema import answer_code, apply_schema, build_schema
+from validation import validate
+
+# Parsed workbooks are kept as uncompressed Arrow files so a cold start can
+# memory-map them instead of running the Excel parse again.
+CACHE_DIR = os.environ.get(
+    "MNHN_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mnhn_cache"),
+)
+
+# Column identifying a submission, used to tell appended rows from edits.
+SUBMISSION_KEYS = [os.environ.get("MNHN_SUBMISSION_KEY", "KEY"), "_uuid", "instanceID", "meta/instanceID"]
+
+# Bump whenever prepare_data() or the schema changes so stale snapshots are
+# not reused.
+SNAPSHOT_VERSION = 8
+
+
+def prepare_data(data):
+    data = data.copy()
+    data['cb4'] = pd.to_numeric(data['cb4'], errors='coerce')
+    data = data.dropna(subset=['cb4'])
+    data['AC2'] = pd.to_numeric(data['AC2'], errors='coerce').fillna(0).astype(int)
+    # Derived fields are cheap to store and then never recomputed per module.
+    return ensure_derived(data.reset_index(drop=True), DERIVED_FIELDS)
+
+
+def read_sheets(source):
+    with metrics.span("load.read_sheets"), pd.ExcelFile(source) as xls:
+        raw = xls.parse("Database")
+        key = xls.parse("Key")
+        mrq_error = None
+        try:
+            key_mrq = xls.parse("Key_MRQ")
+            mrq_text_dict = dict(zip(key_mrq['Variable'], key_mrq['TEXT']))
+        except Exception as e:
+            mrq_error = str(e)
+            mrq_text_dict = {}
+    return raw, key, mrq_text_dict, mrq_error
+
+
+def workbook_schema(raw, key, mrq_text_dict):
+    return build_schema(list(raw.columns) + list(DERIVED_FIELDS), key, mrq_text_dict)
+
+
+def validate_raw(raw, key, mrq_text_dict, schema):
+    """Data-quality report of the raw Database rows, before any coercion."""
+    with metrics.span("load.validate", rows=len(raw)):
+        return validate(raw, key, mrq_text_dict, schema, ignore=[submission_key(raw.columns)])
+
+
+def parse_workbook(source):
+    """Parse and prepare a workbook into the dict stored by write_snapshot()."""
+    return prepare_workbook(*read_sheets(source))
+
+
+def prepare_workbook(raw, key, mrq_text_dict, mrq_error):
+    """The snapshot dict of sheets already read by read_sheets()."""
+    schema = workbook_schema(raw, key, mrq_text_dict)
+    validation = validate_raw(raw, key, mrq_text_dict, schema)
+    with metrics.span("load.derive", rows=len(raw)):
+        data = apply_schema(prepare_data(raw), schema)
+    return {
+        "data": data,
+        "key": key,
+        "mrq_text_dict": mrq_text_dict,
+        "mrq_error": mrq_error,
+        "schema": schema,
+        "row_hashes": row_hashes(raw),
+        "validation": validation,
+    }
+
+
+def submission_key(columns):
+    for col in SUBMISSION_KEYS:
+        if col in columns:
+            return col
+    return None
+
+
+def _answer_text(values):
+    # The same answer as the same text whatever the column's dtype: a blank
+    # among new rows turns an int column float, which must not change how the
+    # existing rows hash.
+    present = values.notna()
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        numbers = values.to_numpy(dtype=float, na_value=np.nan)
+        if (numbers[present.to_numpy()] % 1 == 0).all():
+            values = values.astype('Int64')
+    elif values.dtype == object:
+        values = values.map(answer_code, na_action='ignore')
+    return values.astype(str).where(present, '')
+
+
+def row_hashes(raw):
+    """Content hash of every Database row, indexed by its submission key, so a
+    later version of the sheet can be checked for appended-only changes."""
+    key_col = submission_key(raw.columns)
+    if key_col is None or raw[key_col].isna().any() or raw[key_col].duplicated().any():
+        return None
+    hashes = pd.util.hash_pandas_object(raw.apply(_answer_text), index=False)
+    return pd.Series(hashes.to_numpy(), index=pd.Index(raw[key_col].astype(str), name=key_col))
+
+
+def _arrow_safe(frame):
+    # Excel columns often mix numbers and text; Arrow needs one type per column.
+    frame = frame.copy()
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            try:
+                pa.array(frame[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                frame[col] = frame[col].where(frame[col].isna(), frame[col].astype(str))
+    frame.columns = [str(col) for col in frame.columns]
+    return frame
+
+
+def _snapshot_path(digest, cache_dir):
+    return os.path.join(cache_dir, f"v{SNAPSHOT_VERSION}-{digest}")
+
+
+def read_snapshot(digest, cache_dir=CACHE_DIR):
+    with metrics.span("load.snapshot_read"):
+        return _read_snapshot(_snapshot_path(digest, cache_dir))
+
+
+def _read_snapshot(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as fh:
+            meta = json.load(fh)
+        data = feather.read_table(os.path.join(path, "data.arrow"), memory_map=True)
+        key = feather.read_table(os.path.join(path, "key.arrow"), memory_map=True)
+        hashes = None
+        if meta["submission_key"] is not None:
+            rows = feather.read_table(os.path.join(path, "rows.arrow"), memory_map=True).to_pandas()
+            hashes = pd.Series(rows["hash"].to_numpy(),
+                               index=pd.Index(rows["key"], name=meta["submission_key"]))
+        validation = None
+        if os.path.exists(os.path.join(path, "validation.arrow")):
+            validation = feather.read_table(os.path.join(path, "validation.arrow")).to_pandas()
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+    return {
+        "data": data.to_pandas(split_blocks=True),
+        "key": key.to_pandas(),
+        "mrq_text_dict": meta["mrq_text_dict"],
+        "mrq_error": meta["mrq_error"],
+        "schema": meta["schema"],
+        "row_hashes": hashes,
+        "validation": validation,
+    }
+
+
+def write_snapshot(digest, snapshot, cache_dir=CACHE_DIR):
+    path = _snapshot_path(digest, cache_dir)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    feather.write_feather(_arrow_safe(snapshot["data"]), os.path.join(tmp_path, "data.arrow"),
+                          compression="uncompressed")
+    feather.write_feather(_arrow_safe(snapshot["key"]), os.path.join(tmp_path, "key.arrow"),
+                          compression="uncompressed")
+    hashes = snapshot["row_hashes"]
+    if hashes is not None:
+        rows = pd.DataFrame({"key": hashes.index.astype(str), "hash": hashes.to_numpy()})
+        feather.write_feather(rows, os.path.join(tmp_path, "rows.arrow"), compression="uncompressed")
+    if snapshot.get("validation") is not None:
+        feather.write_feather(snapshot["validation"], os.path.join(tmp_path, "validation.arrow"),
+                              compression="uncompressed")
+    with open(os.path.join(tmp_path, "meta.json"), "w") as fh:
+        json.dump({"mrq_text_dict": {str(k): v for k, v in snapshot["mrq_text_dict"].items()},
+                   "mrq_error": snapshot["mrq_error"],
+                   "schema": snapshot["schema"],
+                   "submission_key": None if hashes is None else hashes.index.name}, fh)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    # Only the latest snapshot is worth keeping.
+    for name in os.listdir(cache_dir):
+        other = os.path.join(cache_dir, name)
+        if other != path and name.startswith("v") and ".tmp-" not in name:
+            shutil.rmtree(other, ignore_errors=True)
+
+
+def save_snapshot(digest, snapshot, cache_dir=CACHE_DIR):
+    """Write ``snapshot`` and return it as re-read from disk, so first and
+    later loads hand back identical dtypes."""
+    try:
+        with metrics.span("load.snapshot_write"):
+            write_snapshot(digest, snapshot, cache_dir)
+    except (OSError, pa.ArrowException):
+        return snapshot
+    return read_snapshot(digest, cache_dir) or snapshot
+
+
+def load_workbook(path, digest, cache_dir=CACHE_DIR):
+    """Return (data, key, mrq_text_dict, mrq_error) for the workbook at
+    ``path``, parsing the Excel file only when no snapshot exists for its
+    content ``digest``."""
+    snapshot = read_snapshot(digest, cache_dir)
+    if snapshot is None:
+        snapshot = save_snapshot(digest, parse_workbook(path), cache_dir)
+    return snapshot["data"], snapshot["key"], snapshot["mrq_text_dict"], snapshot["mrq_error"]
@@ -0,0 +1,302 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_string_dtype, union_categoricals
+
+import metrics
+from aggregates import DistrictCube
+from fetch import fetch_source, file_hash
+from registry import DERIVED_FIELDS, MODULES_BY_NAME
+from schema import answer_code, apply_schema
+from shared_cache import SharedCache
+from snapshot import (CACHE_DIR, prepare_data, prepare_workbook, read_sheets, read_snapshot,
+                      row_hashes, save_snapshot, validate_raw, workbook_schema)
+from validation import merge_reports
+
+# Rendered charts/tables kept per Workbook, least recently used dropped first.
+MAX_ARTIFACTS = 5000
+
+# Every session reads the same Workbook.data, so frames derived from it must
+# never write back into it. pandas 3 always copies on write; earlier versions
+# need the option (it is deprecated, and a no-op, from 3.0 on).
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+
+class Workbook:
+    """One data version: the prepared frame plus module cubes built on demand,
+    or taken from the ``shared`` cache when another replica built them."""
+
+    def __init__(self, version, data, key, mrq_text_dict, mrq_error=None, schema=None,
+                 row_hashes=None, cubes=None, districts=None, shared=None, validation=None):
+        self.version = version
+        self.data = data
+        self.key = key
+        self.mrq_text_dict = mrq_text_dict
+        self.mrq_error = mrq_error
+        self.schema = schema
+        self.row_hashes = row_hashes
+        self.validation = validation
+        self.districts = districts or DistrictCube(data[['District']])
+        self._cubes = dict(cubes or {})
+        self.shared = shared
+        self._artifacts = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rename_dict(self):
+        return dict(zip(self.key['Variables'], self.key['TEXT']))
+
+    def cube(self, module_name):
+        # _lock only guards the dicts; a cube is built under its own module
+        # lock, so cached cubes and artifacts never wait on a build.
+        with self._lock:
+            cube = self._cubes.get(module_name)
+            if cube is None:
+                building = self._building.setdefault(module_name, threading.Lock())
+        metrics.cache_lookup("cube", cube is not None, module=module_name)
+        if cube is not None:
+            return cube
+        with building:
+            with self._lock:
+                cube = self._cubes.get(module_name)
+            if cube is not None:
+                return cube
+            cube = None if self.shared is None else self.shared.cube(self.version, module_name)
+            if cube is None:
+                module = MODULES_BY_NAME[module_name]
+                with metrics.span(f"aggregate.{module.key}", rows=len(self.data)):
+                    cube = module.build(self.data)
+                if self.shared is not None:
+                    self.shared.put_cube(self.version, module_name, cube)
+            with self._lock:
+                self._cubes[module_name] = cube
+        return cube
+
+    def artifact(self, key, build):
+        """Return ``build()`` memoised under ``key``; ``key[0]`` names the
+        kind of artifact for the cache counters. Builds run outside the lock,
+        so two callers may race to build the same artifact."""
+        with self._lock:
+            hit = key in self._artifacts
+            if hit:
+                self._artifacts.move_to_end(key)
+                value = self._artifacts[key]
+        metrics.cache_lookup(key[0], hit)
+        if hit:
+            return value
+        value = build()
+        with self._lock:
+            self._artifacts[key] = value
+            while len(self._artifacts) > MAX_ARTIFACTS:
+                self._artifacts.popitem(last=False)
+        return value
+
+    def built_cubes(self):
+        with self._lock:
+            return dict(self._cubes)
+
+    def snapshot(self):
+        return {
+            "data": self.data,
+            "key": self.key,
+            "mrq_text_dict": self.mrq_text_dict,
+            "mrq_error": self.mrq_error,
+            "schema": self.schema,
+            "row_hashes": self.row_hashes,
+            "validation": self.validation,
+        }
+
+    def append(self, version, new_rows, hashes, key=None, mrq_text_dict=None, mrq_error=None):
+        """Return the next version with raw ``new_rows`` prepared and folded in.
+
+        Only the new rows go through prepare_data, the schema and the module
+        aggregations; existing cubes are merged rather than rebuilt.
+        """
+        key = self.key if key is None else key
+        mrq_text_dict = self.mrq_text_dict if mrq_text_dict is None else mrq_text_dict
+        validation = merge_reports(self.validation, validate_raw(new_rows, key, mrq_text_dict, self.schema))
+        with metrics.span("load.append", rows=len(new_rows)):
+            delta = apply_schema(prepare_data(new_rows), self.schema)
+            data = _concat(self.data, delta)
+            cubes = {name: cube.merge(MODULES_BY_NAME[name].build(delta))
+                     for name, cube in self.built_cubes().items()}
+        return Workbook(
+            version, data, key, mrq_text_dict, mrq_error, self.schema, hashes, cubes,
+            self.districts.merge(DistrictCube(delta[['District']])), self.shared, validation,
+        )
+
+
+def _concat(data, delta):
+    # A small delta can land on the other side of the schema's categorical
+    # cut-off, so each column follows the dtype already chosen for ``data``.
+    columns = {}
+    for col in data.columns:
+        old, new = data[col], delta[col]
+        if isinstance(old.dtype, CategoricalDtype):
+            if old.cat.ordered:
+                # Ordered categories (e.g. cb4_class bins) are fixed up front.
+                new = new.astype(old.dtype)
+                columns[col] = pd.concat([old, new], ignore_index=True)
+                continue
+            new = _with_categories_like(new, old.cat.categories)
+            columns[col] = pd.Series(union_categoricals([old, new], sort_categories=True), name=col)
+        else:
+            if isinstance(new.dtype, CategoricalDtype):
+                new = new.astype(new.cat.categories.dtype)
+            columns[col] = pd.concat([old, new], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _with_categories_like(new, categories):
+    """``new`` as a categorical whose categories have the dtype of
+    ``categories``: a delta column can be read as float (all blank, or codes
+    with a blank) where the data has int or text codes. Left as it is when
+    its answers do not fit that dtype."""
+    present = new.notna().to_numpy()
+    values = new[present].astype(object)
+    if is_string_dtype(categories.dtype):
+        values = values.map(answer_code)
+    try:
+        values = values.astype(categories.dtype)
+    except (TypeError, ValueError):
+        return new if isinstance(new.dtype, CategoricalDtype) else new.astype('category')
+    dtype = CategoricalDtype(pd.Index(values.unique(), dtype=categories.dtype).sort_values())
+    codes = np.full(len(new), -1, dtype=np.int64)
+    codes[present] = pd.Categorical(values, dtype=dtype).codes
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=new.index, name=new.name)
+
+
+def appended_rows(previous, raw, hashes):
+    """Rows of ``raw`` not seen in ``previous``, or None unless the sheet
+    only gained rows (none removed or edited) since ``previous``."""
+    if previous is None or hashes is None or previous.index.name != hashes.index.name:
+        return None
+    if not previous.index.isin(hashes.index).all():
+        return None
+    if (hashes.reindex(previous.index) != previous).any():
+        return None
+    return raw[~hashes.index.isin(previous.index)]
+
+
+class WorkbookStore:
+    """Process-wide holder of the current Workbook.
+
+    A changed source is ingested incrementally when the Database sheet only
+    gained rows (matched by submission key); anything else is a full reload.
+    Every version loaded is published to the ``shared`` cache, so the other
+    replicas using it follow without fetching the source themselves.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, shared=None):
+        self.cache_dir = cache_dir
+        self.shared = shared or SharedCache()
+        self.current = None
+        self._lock = threading.Lock()
+
+    def latest(self, url):
+        """The published Workbook, from the shared cache when this replica
+        does not hold it yet; the source is only fetched when nothing is
+        published."""
+        version = self.shared.current_version()
+        current = self.current
+        if current is not None and current.version == version:
+            return current
+        if version is not None:
+            with self._lock:
+                if self.current is not None and self.current.version == version:
+                    return self.current
+                snapshot = self.shared.snapshot(version)
+                metrics.cache_lookup("shared", snapshot is not None)
+                if snapshot is not None:
+                    self.current = Workbook(version, shared=self.shared, **snapshot)
+                    return self.current
+        elif current is not None:
+            return current
+        return self.refresh(url)
+
+    def refresh(self, url):
+        """Fetch ``url`` and publish it if it changed. Only one replica
+        refreshes at a time; one that waited on another takes its result."""
+        with self.shared.single_flight("refresh") as leader:
+            if not leader:
+                return self.latest(url)
+            with metrics.span("load.fetch"):
+                path, digest, changed = fetch_source(url, self.cache_dir)
+            metrics.cache_lookup("source", not changed)
+            if not changed and self.current is not None:
+                # Keeps any side-loaded deltas until the source itself moves on.
+                return self.current
+            workbook = self.load(path, digest)
+            self._publish(workbook)
+            return workbook
+
+    def _publish(self, workbook):
+        self.shared.publish(workbook.version, workbook.snapshot(), workbook.built_cubes())
+
+    def load(self, path, digest):
+        with self._lock:
+            current = self.current
+            if current is not None and current.version == digest:
+                return current
+            snapshot = read_snapshot(digest, self.cache_dir) or self.shared.snapshot(digest)
+            metrics.cache_lookup("snapshot", snapshot is not None)
+            if snapshot is None:
+                workbook = self._ingest(current, path, digest)
+            else:
+                workbook = Workbook(digest, shared=self.shared, **snapshot)
+            self.current = workbook
+            return workbook
+
+    def _ingest(self, current, path, digest):
+        raw, key, mrq_text_dict, mrq_error = read_sheets(path)
+        if current is not None and workbook_schema(raw, key, mrq_text_dict) == current.schema:
+            hashes = row_hashes(raw)
+            new_rows = appended_rows(current.row_hashes, raw, hashes)
+            try:
+                if new_rows is not None:
+                    workbook = current.append(digest, new_rows, hashes, key, mrq_text_dict, mrq_error)
+                    save_snapshot(digest, workbook.snapshot(), self.cache_dir)
+                    return workbook
+            except TypeError:
+                pass  # categories of mixed types cannot be merged in order
+        snapshot = save_snapshot(digest, prepare_workbook(raw, key, mrq_text_dict, mrq_error), self.cache_dir)
+        return Workbook(digest, shared=self.shared, **snapshot)
+
+    def ingest_delta(self, path):
+        """Fold a side-loaded file of new Database rows (CSV or a workbook with
+        a Database sheet) into the current version. Rows whose submission key
+        is already known are skipped."""
+        with self._lock:
+            current = self.current
+            if current is None or current.row_hashes is None:
+                raise ValueError("Load a workbook with a submission key column before ingesting deltas")
+            if os.path.splitext(path)[1].lower() == ".csv":
+                raw = pd.read_csv(path)
+            else:
+                raw = pd.read_excel(path, sheet_name="Database")
+            missing = [col for col in current.schema
+                       if col not in raw.columns and col not in DERIVED_FIELDS]
+            if missing:
+                raise ValueError(f"Delta file is missing columns: {', '.join(missing)}")
+            hashes = row_hashes(raw)
+            if hashes is None:
+                raise ValueError("Delta file has missing or duplicate submission keys")
+            fresh = ~hashes.index.isin(current.row_hashes.index)
+            if not fresh.any():
+                return current
+            digest = hashlib.sha256(f"{current.version}:{file_hash(path)}".encode()).hexdigest()
+            try:
+                workbook = current.append(digest, raw[fresh], pd.concat([current.row_hashes, hashes[fresh]]))
+            except TypeError as e:
+                raise ValueError(f"Delta file answers do not match the loaded data: {e}") from e
+            save_snapshot(digest, workbook.snapshot(), self.cache_dir)
+            self.current = workbook
+        self._publish(workbook)
+        return workbook
+
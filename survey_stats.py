@@ -0,0 +1,126 @@
+"""Design-based weighted proportions with cluster-robust standard errors.
+
+Each district is a stratum and each (District, cluster) pair a primary
+sampling unit. A SurveyCube keeps, per variable, the weighted sum of every
+category in every cluster; any district selection's proportions and
+linearised (Taylor series) variances then come from a few array operations
+over those sums, with no pass over the interviews and no per-cell loop.
+"""
+import numpy as np
+import pandas as pd
+
+from registry import find_multi_select_groups
+from schema import CLUSTER_COLUMN, WEIGHT_COLUMN
+
+Z_95 = 1.959963984540054
+
+
+def _stratified_variance(totals, strata, n_strata):
+    """sum over clusters g of stratum h of n_h/(n_h-1) (t_g - mean_h)^2, per
+    row of ``totals`` (rows x clusters) and stratum; NaN for one-cluster strata."""
+    clusters = np.bincount(strata, minlength=n_strata)
+    members = np.zeros((len(strata), n_strata))
+    members[np.arange(len(strata)), strata] = 1
+    sums = totals @ members
+    squares = (totals ** 2) @ members
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(clusters > 1, (squares - sums ** 2 / clusters) * clusters / (clusters - 1), np.nan)
+
+
+class SurveyCube:
+    """Weighted (category x cluster) sums for single-response ``variables``
+    and multi-response ``groups``, ready for weighted estimates by district.
+
+    Interviews whose weight is blank or not a number are left out (the
+    validation report counts them); without a weight column every interview
+    has weight 1, and without a cluster column every interview is its own
+    cluster.
+    """
+
+    def __init__(self, data, variables=(), groups=None, weight_column=WEIGHT_COLUMN,
+                 cluster_column=CLUSTER_COLUMN):
+        self.weighted = weight_column in data.columns
+        keep = data['District'].notna().to_numpy()
+        if self.weighted:
+            weights = pd.to_numeric(data[weight_column], errors='coerce')
+            keep = keep & weights.notna().to_numpy()
+        data = data[keep]
+        district_codes, self.district_labels = pd.factorize(data['District'], sort=True)
+        if cluster_column in data.columns:
+            cluster_codes, cluster_labels = pd.factorize(data[cluster_column], use_na_sentinel=False)
+            units = district_codes.astype(np.int64) * len(cluster_labels) + cluster_codes
+            self.clusters, unit_labels = pd.factorize(units)
+            self.strata = unit_labels // len(cluster_labels)
+        else:
+            self.clusters = np.arange(len(data))
+            self.strata = district_codes
+        if self.weighted:
+            self.weights = weights[keep].to_numpy(float)
+        else:
+            self.weights = np.ones(len(data))
+
+        self.cells = {}
+        for var in dict.fromkeys(variables):
+            if var in data.columns:
+                self.cells[var] = self._single(data[var])
+        for prefix, cols in (groups or {}).items():
+            self.cells[prefix] = self._multi(data[cols])
+
+    def _single(self, values):
+        valid = values.notna().to_numpy()
+        codes, labels = pd.factorize(values[valid], sort=True)
+        n_clusters = len(self.strata)
+        clusters, weights = self.clusters[valid], self.weights[valid]
+        sums = np.bincount(codes * n_clusters + clusters, weights, minlength=len(labels) * n_clusters)
+        bases = np.bincount(clusters, weights, minlength=n_clusters)
+        return pd.Index(labels), sums.reshape(len(labels), n_clusters), bases
+
+    def _multi(self, frame):
+        # As in MultiResponseCube: an option counts when coded 1, and the base
+        # is the interviews with at least one option selected.
+        selected = (frame.apply(pd.to_numeric, errors='coerce') == 1).to_numpy()
+        rows, options = np.nonzero(selected)
+        sums = np.bincount(self.clusters[rows] * frame.shape[1] + options, self.weights[rows],
+                           minlength=len(self.strata) * frame.shape[1]).reshape(len(self.strata), frame.shape[1])
+        bases = np.bincount(self.clusters, self.weights * selected.any(axis=1), minlength=len(self.strata))
+        return pd.Index(frame.columns), sums.T, bases
+
+    def estimates(self, key, selected=None):
+        """Return (percent, lower, upper) frames: weighted % of each category
+        of ``key`` and its 95% confidence bounds, with a column per selected
+        district (all when ``selected`` is empty) plus Total."""
+        labels, sums, bases = self.cells[key]
+        districts = [i for i, district in enumerate(self.district_labels)
+                     if not selected or district in selected]
+        in_selection = np.isin(self.strata, districts)
+        sums, bases = sums[:, in_selection], bases[in_selection]
+        strata = np.searchsorted(districts, self.strata[in_selection])
+        n_strata = len(districts)
+
+        members = np.zeros((len(strata), n_strata))
+        members[np.arange(len(strata)), strata] = 1
+        district_sums, district_bases = sums @ members, bases @ members
+        total_sums, total_base = district_sums.sum(axis=1), district_bases.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = district_sums / district_bases
+            total_share = total_sums / total_base
+            # Linearised cluster totals of the ratio estimator.
+            by_district = (sums - share[:, strata] * bases) / district_bases[strata]
+            by_total = (sums - total_share[:, None] * bases) / total_base
+        variance = _stratified_variance(by_district, strata, n_strata)
+        total_variance = _stratified_variance(by_total, strata, n_strata).sum(axis=1)
+
+        share = np.column_stack([share, total_share])
+        error = np.sqrt(np.column_stack([variance, total_variance])) * Z_95
+        columns = [self.district_labels[i] for i in districts] + ['Total']
+        frames = [pd.DataFrame(values * 100, index=labels, columns=columns)
+                  for values in (share, np.clip(share - error, 0, 1), np.clip(share + error, 0, 1))]
+        return tuple(frames)
+
+
+def module_survey_cube(data, module):
+    """SurveyCube over the variables (or multi-response groups) of ``module``."""
+    if module.multi_response:
+        groups = find_multi_select_groups(module.columns(data.columns))
+        return SurveyCube(data, groups=groups)
+    return SurveyCube(data, [var for var in module.single_cats if var in data.columns])
@@ -0,0 +1,182 @@
+import csv
+import io
+
+import numpy as np
+import xlsxwriter
+
+HEADER_COLOR = "#2905f5"
+TOTAL_COLOR = "#5337f3"
+
+TABLE_STYLE = (
+    '<style>\n'
+    'table.customtbl {border-collapse: collapse; width: 100%;}\n'
+    f'table.customtbl th {{background: {HEADER_COLOR}; font-weight: bold; border: 1px solid #aaa; padding: 6px;}}\n'
+    'table.customtbl td {border: 1px solid #aaa; padding: 6px;}\n'
+    '</style>\n'
+)
+
+N_PCT_COLUMNS = ('N', '%')
+ESTIMATE_COLUMNS = ('N', '%', 'Weighted %', '95% CI')
+
+
+def n_pct_rows(counts, percents, bases, labels=None):
+    """Interleave N and % cells for each row of ``counts`` and append the
+    Total row of ``bases``. ``counts`` and ``percents`` share one layout."""
+    labels = list(counts.index) if labels is None else list(labels)
+    cells = np.empty((len(counts), 2 * counts.shape[1]), dtype=object)
+    cells[:, 0::2] = counts.to_numpy()
+    cells[:, 1::2] = np.char.mod('%.1f%%', np.asarray(percents, dtype=float))
+    rows = [[label] + list(row) for label, row in zip(labels, cells)]
+    total_row = ['Total']
+    for base in bases:
+        total_row.extend([base, "100.0%"])
+    rows.append(total_row)
+    return rows
+
+
+def single_response_rows(count_table):
+    count_table = count_table.copy()
+    count_table['Total'] = count_table.sum(axis=1)
+    col_totals = count_table.sum(axis=0)
+    percent_table = count_table.div(col_totals, axis=1).fillna(0) * 100
+    percent_table = percent_table.round(1)
+    return n_pct_rows(count_table, percent_table, col_totals)
+
+
+def multi_response_rows(counts, bases, labels):
+    base_values = bases.to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percents = np.where(base_values > 0, counts.to_numpy() / base_values * 100, 0)
+    return n_pct_rows(counts, percents, bases, labels)
+
+
+def _format_percent(values):
+    return np.where(np.isnan(values), '–', np.char.mod('%.1f%%', np.nan_to_num(values)))
+
+
+def with_estimates(rows, percent, lower, upper):
+    """Add a weighted % and 95% CI cell after each N/% pair of ``rows``.
+    ``percent``, ``lower`` and ``upper`` hold one row per category row and
+    one column per N/% pair; the Total row gets 100% and no interval."""
+    intervals = np.char.add(np.char.add(np.char.mod('%.1f', np.nan_to_num(lower)), '–'),
+                            np.char.mod('%.1f', np.nan_to_num(upper)))
+    intervals = np.where(np.isnan(lower) | np.isnan(upper), '–', intervals)
+    percents = _format_percent(percent)
+    estimate_rows = []
+    for row, row_percents, row_intervals in zip(rows, percents, intervals):
+        cells = [row[0]]
+        for i, (pct, interval) in enumerate(zip(row_percents, row_intervals)):
+            cells.extend([row[1 + 2 * i], row[2 + 2 * i], pct, interval])
+        estimate_rows.append(cells)
+    total = rows[-1]
+    total_row = [total[0]]
+    for i in range(1, len(total), 2):
+        total_row.extend([total[i], total[i + 1], "100.0%", ""])
+    return estimate_rows + [total_row]
+
+
+def single_response_table(cube, var, selected=None):
+    """Return (columns, rows) of the N/% table for one single-response variable."""
+    count_table = cube.table(var, selected)
+    return list(count_table.columns) + ['Total'], single_response_rows(count_table)
+
+
+def multi_response_table(cube, prefix, option_labels, selected=None):
+    """Return (columns, rows) of the N/% table for one multi-response group."""
+    counts, bases = cube.table(prefix, selected)
+    return list(bases.index), multi_response_rows(counts, bases, option_labels)
+
+
+def render_n_pct_table(columns, rows, var_title, sub_columns=N_PCT_COLUMNS):
+    """HTML for a two-level N/% table; ``columns`` are the top-level headers,
+    each spanning ``sub_columns``."""
+    total_style = f'font-weight:bold;background:{TOTAL_COLOR}'
+    total_col = len(sub_columns) * (len(columns) - 1)
+    parts = [
+        TABLE_STYLE,
+        '<table class="customtbl">\n',
+        f'<tr><th rowspan="2">{var_title}</th>',
+        ''.join(f'<th colspan="{len(sub_columns)}">{col}</th>' for col in columns),
+        '</tr>\n<tr>',
+        ''.join(f'<th>{sub}</th>' for sub in sub_columns) * len(columns),
+        '</tr>\n',
+    ]
+    for row in rows:
+        is_total_row = str(row[0]).lower() == 'total'
+        parts.append(f'<tr><td style="{total_style if is_total_row else "font-weight:bold"}">{row[0]}</td>')
+        parts.append(''.join(
+            f'<td style="{total_style if is_total_row or i >= total_col else ""}">{val}</td>'
+            for i, val in enumerate(row[1:])
+        ))
+        parts.append('</tr>\n')
+    parts.append('</table>')
+    return ''.join(parts)
+
+
+def n_pct_csv(columns, rows, var_title, sub_columns=N_PCT_COLUMNS):
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer)
+    padding = [''] * (len(sub_columns) - 1)
+    writer.writerow([var_title] + [item for col in columns for item in [col] + padding])
+    writer.writerow([''] + list(sub_columns) * len(columns))
+    writer.writerows(rows)
+    return csv_buffer.getvalue().encode('utf-8')
+
+
+def _xlsx_value(value, percent_format):
+    # N cells arrive as numpy integers and % cells as "12.3%" strings.
+    if isinstance(value, np.generic):
+        return value.item(), None
+    if isinstance(value, str) and value.endswith('%'):
+        try:
+            return float(value[:-1]) / 100, percent_format
+        except ValueError:
+            pass
+    return value, None
+
+
+def n_pct_xlsx(sheets):
+    """XLSX bytes with one worksheet per ``(name, tables)`` of ``sheets``,
+    where each table is ``(title, columns, rows, sub_columns)`` as given to
+    render_n_pct_table; the tables of a sheet are stacked with a blank row
+    between them. Rows are streamed out as written (constant-memory mode),
+    so the whole report is never held as cell objects."""
+    output = io.BytesIO()
+    book = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header = book.add_format({'bold': True, 'font_color': 'white', 'bg_color': HEADER_COLOR, 'border': 1,
+                              'align': 'center', 'valign': 'vcenter', 'text_wrap': True})
+    label = book.add_format({'bold': True, 'border': 1})
+    total = book.add_format({'bold': True, 'font_color': 'white', 'bg_color': TOTAL_COLOR, 'border': 1})
+    total_percent = book.add_format({'bold': True, 'font_color': 'white', 'bg_color': TOTAL_COLOR, 'border': 1,
+                                     'num_format': '0.0%'})
+    cell = book.add_format({'border': 1})
+    percent = book.add_format({'border': 1, 'num_format': '0.0%'})
+    for name, tables in sheets:
+        sheet = book.add_worksheet(name)
+        sheet.set_column(0, 0, 45)
+        row = 0
+        for title, columns, rows, sub_columns in tables:
+            width = len(sub_columns)
+            # Constant-memory mode flushes a row once a later one is written,
+            # so the two-row title cell is merged only after the first row.
+            for i, col in enumerate(columns):
+                first = 1 + i * width
+                if width > 1:
+                    sheet.merge_range(row, first, row, first + width - 1, str(col), header)
+                else:
+                    sheet.write(row, first, str(col), header)
+            sheet.merge_range(row, 0, row + 1, 0, title, header)
+            sheet.write_row(row + 1, 1, list(sub_columns) * len(columns), header)
+            row += 2
+            total_col = width * (len(columns) - 1)
+            for cells in rows:
+                is_total_row = str(cells[0]).lower() == 'total'
+                sheet.write(row, 0, cells[0], total if is_total_row else label)
+                for i, value in enumerate(cells[1:]):
+                    in_total = is_total_row or i >= total_col
+                    value, fmt = _xlsx_value(value, total_percent if in_total else percent)
+                    sheet.write(row, 1 + i, value, fmt or (total if in_total else cell))
+                row += 1
+            row += 1
+    book.close()
+    return output.getvalue()
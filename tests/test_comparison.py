@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from aggregates import CountCube
+from comparison import align_round, comparison_table
+from schema import apply_schema
+from store import Workbook
+
+SCHEMA = {'District': 'category', 'IF1': 'category'}
+
+
+def _workbook(version, if1):
+    data = pd.DataFrame({'District': ['Dadu', 'Dadu', 'Thatta', 'Thatta'][:len(if1)], 'IF1': if1})
+    return Workbook(version, apply_schema(data, SCHEMA), pd.DataFrame({'Variables': [], 'TEXT': []}), {},
+                    schema=SCHEMA)
+
+
+def test_int_and_float_coded_rounds_share_categories():
+    endline = _workbook('endline', [1, 2, 1, 1])
+    # The blank makes this round's codes floats.
+    baseline = align_round(_workbook('baseline', [1.0, 2.0, 2.0, np.nan]), endline)
+
+    columns, rows, shares = comparison_table(CountCube(baseline.data, ['IF1']),
+                                             CountCube(endline.data, ['IF1']), 'IF1')
+
+    assert columns == ['Dadu', 'Thatta', 'Total']
+    assert [row[0] for row in rows] == ['1', '2', 'Total']
+    # Total column of the "1" row: baseline 1 of 3, endline 3 of 4.
+    assert rows[0][-3:] == ['33.3%', '75.0%', '+41.7 pp']
+    assert rows[-1][-3:] == ['N=3', 'N=4', '']
+
+
+def test_text_and_number_coded_rounds_share_categories():
+    endline = _workbook('endline', ['1', '2', '1', '1'])
+    baseline = align_round(_workbook('baseline', [1.0, 2.0, 2.0, np.nan]), endline)
+
+    columns, rows, shares = comparison_table(CountCube(baseline.data, ['IF1']),
+                                             CountCube(endline.data, ['IF1']), 'IF1')
+
+    assert [row[0] for row in rows] == ['1', '2', 'Total']
+    assert rows[0][-3:] == ['33.3%', '75.0%', '+41.7 pp']
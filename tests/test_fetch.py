@@ -0,0 +1,104 @@
+import hashlib
+import http.server
+import json
+import os
+import threading
+
+import pytest
+import requests
+
+from fetch import fetch_source
+
+
+class SourceHandler(http.server.BaseHTTPRequestHandler):
+    """Serves ``server.body`` with an ETag, 304s, Range/If-Range and 416s;
+    the first ``server.drops`` responses are cut off half way."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.body
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.server.seen.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start, status = 0, 200
+        if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+            start, status = int(self.headers['Range'].split('=')[1].rstrip('-')), 206
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        if self.server.drops:
+            self.server.drops -= 1
+            self.wfile.write(body[start:start + len(body) // 2])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SourceHandler)
+    httpd.body = os.urandom(500_000)
+    httpd.seen = []
+    httpd.drops = 0
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return 'http://127.0.0.1:%d/source.xlsx' % server.server_address[1]
+
+
+def _fetch(server, cache_dir):
+    return fetch_source(_url(server), str(cache_dir), session=requests.Session(), backoff=0)
+
+
+def test_unchanged_source_is_not_downloaded_again(server, tmp_path):
+    path, digest, changed = _fetch(server, tmp_path)
+    assert changed
+    assert digest == hashlib.sha256(server.body).hexdigest()
+
+    assert _fetch(server, tmp_path) == (path, digest, False)
+    assert server.seen[-1]['If-None-Match']
+
+
+def test_interrupted_download_resumes_with_range(server, tmp_path):
+    server.drops = 1
+    path, digest, changed = _fetch(server, tmp_path)
+
+    assert changed
+    with open(path, 'rb') as fh:
+        assert fh.read() == server.body
+    # Only whole chunks are kept, so the resume starts at or before 250000.
+    first, second = (headers.get('Range') for headers in server.seen)
+    assert first is None
+    assert 0 < int(second.split('=')[1].rstrip('-')) <= 250_000
+
+
+def test_complete_part_file_restarts_without_range(server, tmp_path):
+    etag = '"%s"' % hashlib.md5(server.body).hexdigest()
+    part_path = os.path.join(tmp_path, 'source.xlsx.part')
+    with open(part_path, 'wb') as fh:
+        fh.write(server.body)
+    with open(part_path + '.json', 'w') as fh:
+        json.dump({'url': _url(server), 'etag': etag}, fh)
+
+    path, digest, changed = _fetch(server, tmp_path)
+
+    assert changed
+    assert digest == hashlib.sha256(server.body).hexdigest()
+    assert [headers.get('Range') for headers in server.seen] == ['bytes=500000-', None]
+    assert not os.path.exists(part_path) and not os.path.exists(part_path + '.json')
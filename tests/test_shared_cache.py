@@ -0,0 +1,82 @@
+import functools
+import http.server
+import threading
+import time
+
+import pytest
+
+import shared_cache
+from benchmarks.synthetic import write_workbook
+from shared_cache import SharedCache, backend_from_url
+from store import WorkbookStore
+
+
+@pytest.fixture
+def redis_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, 'LOCK_POLL', 0.05)
+    return 'redis+file://%s' % (tmp_path / 'shared.db')
+
+
+@pytest.fixture
+def source(tmp_path):
+    """URL of a small synthetic workbook, and the list of GETs it served."""
+    root = tmp_path / 'www'
+    root.mkdir()
+    write_workbook(str(root / 'source.xlsx'), 300)
+    requests_seen = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            requests_seen.append(self.path)
+
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                            functools.partial(Handler, directory=str(root)))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d/source.xlsx' % httpd.server_address[1], requests_seen
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_single_flight_waits_for_the_other_store(redis_url):
+    first, second = (SharedCache(backend_from_url(redis_url)) for _ in range(2))
+    entered, results = threading.Event(), []
+
+    def lead():
+        with first.single_flight('refresh') as leader:
+            results.append(leader)
+            entered.set()
+            time.sleep(0.3)
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    entered.wait()
+    started = time.monotonic()
+    with second.single_flight('refresh') as leader:
+        results.append(leader)
+        waited = time.monotonic() - started
+    thread.join()
+
+    assert results == [True, False]
+    assert waited >= 0.2
+    with second.single_flight('refresh') as leader:
+        assert leader
+
+
+def test_one_store_fetches_and_the_other_follows(redis_url, source, tmp_path):
+    url, requests_seen = source
+    stores = [WorkbookStore(str(tmp_path / name), SharedCache(backend_from_url(redis_url)))
+              for name in ('a', 'b')]
+    workbooks = [None, None]
+
+    def load(i):
+        workbooks[i] = stores[i].latest(url)
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(requests_seen) == 1
+    assert workbooks[0].version == workbooks[1].version
+    assert len(workbooks[0].data) == len(workbooks[1].data)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate
+from fetch import file_hash
+from registry import MODULES
+from schema import answer_code
+from shared_cache import SharedCache
+from store import WorkbookStore
+
+
+def _write(path, database, key, key_mrq):
+    with pd.ExcelWriter(path) as writer:
+        database.to_excel(writer, sheet_name='Database', index=False)
+        key.to_excel(writer, sheet_name='Key', index=False)
+        key_mrq.to_excel(writer, sheet_name='Key_MRQ', index=False)
+    return str(path)
+
+
+def _load(tmp_path, name, path):
+    store = WorkbookStore(str(tmp_path / name), SharedCache())
+    return store, store.load(path, file_hash(path))
+
+
+def _tables(workbook):
+    tables = {}
+    for module in MODULES:
+        cube = workbook.cube(module.name)
+        if module.multi_response:
+            for prefix in cube.groups:
+                tables[prefix] = cube.table(prefix)[0]
+        else:
+            for var in cube.counts:
+                table = cube.table(var)
+                tables[var] = table.set_axis(table.index.map(answer_code))
+    return tables
+
+
+@pytest.fixture
+def survey():
+    database, key, key_mrq = generate(300, seed=1)
+    coded = [var for var in key['Variables'] if var in database.columns
+             and pd.api.types.is_string_dtype(database[var])]
+    # One question coded 1/2 rather than labelled, as many are.
+    database[coded[1]] = np.random.default_rng(1).integers(1, 3, len(database))
+    return database, key, key_mrq, coded[0], coded[1]
+
+
+def test_delta_with_blank_columns_matches_full_reload(tmp_path, survey):
+    database, key, key_mrq, text_var, coded_var = survey
+    store, _ = _load(tmp_path, 'delta', _write(tmp_path / 'v1.xlsx', database[:280], key, key_mrq))
+    delta = database[280:].copy()
+    delta[text_var] = None
+    delta.loc[delta.index[0], coded_var] = None
+    delta.to_csv(tmp_path / 'delta.csv', index=False)
+
+    workbook = store.ingest_delta(str(tmp_path / 'delta.csv'))
+    _, full = _load(tmp_path, 'full', _write(tmp_path / 'v2.xlsx', pd.concat([database[:280], delta]),
+                                             key, key_mrq))
+
+    assert len(workbook.data) == len(full.data)
+    incremental, reloaded = _tables(workbook), _tables(full)
+    assert incremental.keys() == reloaded.keys()
+    for name, table in reloaded.items():
+        pd.testing.assert_frame_equal(incremental[name], table, check_dtype=False, check_index_type=False,
+                                      check_names=False, obj=name)
+
+
+def test_delta_that_cannot_be_merged_raises_value_error(tmp_path, survey):
+    database, key, key_mrq, text_var, coded_var = survey
+    store, _ = _load(tmp_path, 'delta', _write(tmp_path / 'v1.xlsx', database[:280], key, key_mrq))
+    delta = database[280:].copy()
+    delta[coded_var] = delta[coded_var].astype(object)
+    delta.loc[delta.index[0], coded_var] = 'refused'
+    delta.to_csv(tmp_path / 'delta.csv', index=False)
+
+    with pytest.raises(ValueError):
+        store.ingest_delta(str(tmp_path / 'delta.csv'))
+
+
+def test_append_with_blanks_stays_incremental(tmp_path, survey, monkeypatch):
+    database, key, key_mrq, text_var, coded_var = survey
+    v1 = _write(tmp_path / 'v1.xlsx', database[:280], key, key_mrq)
+    appended = database.copy()
+    # Blanks only among the new rows turn these int columns float.
+    appended[coded_var] = appended[coded_var].astype(float)
+    appended.loc[290, [coded_var, 'AC4_1', text_var]] = np.nan
+    v2 = _write(tmp_path / 'v2.xlsx', appended, key, key_mrq)
+    store, _ = _load(tmp_path, 'store', v1)
+
+    def full_reload(*args):
+        raise AssertionError("appended rows were not ingested incrementally")
+
+    with monkeypatch.context() as patch:
+        patch.setattr('store.prepare_workbook', full_reload)
+        workbook = store.load(v2, file_hash(v2))
+    _, full = _load(tmp_path, 'full', v2)
+
+    incremental, reloaded = _tables(workbook), _tables(full)
+    assert incremental.keys() == reloaded.keys()
+    for name, table in reloaded.items():
+        pd.testing.assert_frame_equal(incremental[name], table, check_dtype=False, check_index_type=False,
+                                      check_names=False, obj=name)
@@ -0,0 +1,162 @@
+"""Data-quality checks on the raw Database sheet, run once per data version.
+
+prepare_data() and the schema coerce quietly: a cb4 that is not a number
+drops the interview, a bad AC2 becomes 0, and answers outside a question's
+codes still become categories. validate() runs on the raw sheet first and
+tallies every such value per district and enumerator, so field teams can see
+what to fix. The report is stored with the snapshot, so it is computed once
+per data version.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from registry import DERIVED_FIELDS, find_multi_select_groups
+from schema import WEIGHT_COLUMN, answer_code
+
+ENUMERATOR_COLUMNS = [os.environ.get("MNHN_ENUMERATOR_COLUMN", "Enumerator"), "enumerator", "username",
+                      "deviceid"]
+# A Key sheet column with the allowed answers of each question, e.g.
+# "Yes; No; Don't know" or "1=Yes; 2=No".
+CODE_COLUMNS = ["Codes", "Values", "Options"]
+# Numeric questions and their valid range; cb4 (age in months) outside the
+# cb4_class bins gets no age group.
+RANGES = {'cb4': (0, 11), 'AC2': (0, None)}
+
+REPORT_COLUMNS = ['check', 'column', 'value', 'District', 'Enumerator', 'count']
+CHECKS = {
+    'dropped_row': "Interview dropped: cb4 blank or not a number",
+    'not_numeric': "Not a number (AC2 is counted as 0 visits)",
+    'out_of_range': "Outside the valid range or codes",
+    'missing': "Blank answer (or skipped by the questionnaire)",
+    'no_weight': "Weight blank or not a number (left out of weighted estimates)",
+    'absent_column': "Key or Key_MRQ variable not in the Database sheet",
+    'unknown_column': "Database column in neither Key sheet (not loaded)",
+}
+# Checks of a whole column: reported once per column, not per district and
+# enumerator, with every interview counted.
+COLUMN_CHECKS = ['absent_column', 'unknown_column']
+
+
+def enumerator_column(columns):
+    for col in ENUMERATOR_COLUMNS:
+        if col in columns:
+            return col
+    return None
+
+
+def key_code_labels(key):
+    """Variable -> {code: label}, from the Key sheet's codes column; an
+    answer listed without "=" is its own label."""
+    column = next((col for col in CODE_COLUMNS if col in key.columns), None)
+    if column is None:
+        return {}
+    labels = {}
+    for var, spec in zip(key['Variables'], key[column]):
+        if pd.isna(var) or pd.isna(spec):
+            continue
+        labels[var] = {}
+        for token in re.split(r"[;|\n]", str(spec)):
+            code, _, label = (part.strip() for part in token.partition('='))
+            if code:
+                labels[var][code] = label or code
+    return labels
+
+
+def key_codes(key):
+    """Variable -> set of allowed answers (codes and their labels)."""
+    return {var: set(labels) | set(labels.values()) for var, labels in key_code_labels(key).items()}
+
+
+def _tally(rows, check, column, mask, values=None):
+    """Flagged rows of ``rows`` (District, Enumerator frame) counted by
+    district, enumerator and offending value."""
+    if not mask.any():
+        return None
+    flagged = rows[mask].assign(value='' if values is None else values[mask].map(answer_code).to_numpy())
+    counts = flagged.groupby(['value', 'District', 'Enumerator'], dropna=False, observed=True).size()
+    return counts.rename('count').reset_index().assign(check=check, column=column)
+
+
+def _column_rows(check, columns, count):
+    if not columns:
+        return None
+    return pd.DataFrame({'check': check, 'column': columns, 'value': '', 'District': None,
+                         'Enumerator': None, 'count': count})
+
+
+def validate(raw, key, mrq_text_dict, schema, ignore=()):
+    """Return the report: one row per (check, column, value, District,
+    Enumerator) with the number of interviews affected. Columns outside
+    ``schema`` are reported as not loaded, unless listed in ``ignore``."""
+    enumerator = enumerator_column(raw.columns)
+    rows = pd.DataFrame({
+        'District': raw['District'].astype(str).where(raw['District'].notna(), None) if 'District' in raw else None,
+        'Enumerator': raw[enumerator].astype(str).where(raw[enumerator].notna(), None) if enumerator else None,
+    }, index=raw.index)
+    variables = [var for var in key['Variables'].dropna() if var in raw.columns]
+    groups = find_multi_select_groups(raw.columns)
+    indicators = {col for cols in groups.values() for col in cols}
+    codes = key_codes(key)
+    parts = []
+
+    parts.append(_column_rows('absent_column', [
+        var for var in list(key['Variables'].dropna()) + list(mrq_text_dict)
+        if var not in raw.columns and var not in groups and var not in DERIVED_FIELDS], len(raw)))
+    parts.append(_column_rows('unknown_column', [
+        col for col in raw.columns if col not in schema and col not in ignore and col != enumerator], len(raw)))
+
+    for col, (low, high) in RANGES.items():
+        if col not in raw.columns:
+            continue
+        values = raw[col]
+        numbers = pd.to_numeric(values, errors='coerce')
+        present = values.notna().to_numpy()
+        bad_number = present & numbers.isna().to_numpy()
+        outside = (numbers < low) if low is not None else pd.Series(False, index=raw.index)
+        if high is not None:
+            outside |= numbers > high
+        if col == 'cb4':
+            parts.append(_tally(rows, 'dropped_row', col, ~present | bad_number, values))
+        else:
+            parts.append(_tally(rows, 'not_numeric', col, bad_number, values))
+        parts.append(_tally(rows, 'out_of_range', col, outside.to_numpy(), values))
+
+    if WEIGHT_COLUMN in raw.columns:
+        values = raw[WEIGHT_COLUMN]
+        parts.append(_tally(rows, 'no_weight', WEIGHT_COLUMN,
+                            pd.to_numeric(values, errors='coerce').isna().to_numpy(), values))
+
+    for col in indicators:
+        values = raw[col]
+        numbers = pd.to_numeric(values, errors='coerce')
+        parts.append(_tally(rows, 'out_of_range', col, (values.notna() & ~numbers.isin([0, 1])).to_numpy(), values))
+
+    for var in variables:
+        values = raw[var]
+        missing = values.isna().to_numpy()
+        parts.append(_tally(rows, 'missing', var, missing))
+        if var in codes:
+            # Codes are few; compare the distinct answers, then map back.
+            distinct = pd.unique(values[~missing])
+            allowed = np.array([answer_code(value) in codes[var] for value in distinct], dtype=bool)
+            invalid = values.isin(distinct[~allowed]).to_numpy() & ~missing
+            parts.append(_tally(rows, 'out_of_range', var, invalid, values))
+
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return pd.DataFrame({col: pd.Series(dtype=np.int64 if col == 'count' else object)
+                             for col in REPORT_COLUMNS})
+    return pd.concat(parts, ignore_index=True)[REPORT_COLUMNS]
+
+
+def merge_reports(report, other):
+    """Report covering the interviews of both ``report`` and ``other``, e.g.
+    a version and the rows appended to it."""
+    if report is None:
+        return other
+    merged = pd.concat([report, other], ignore_index=True)
+    keys = ['check', 'column', 'value', 'District', 'Enumerator']
+    return merged.groupby(keys, dropna=False, sort=False)['count'].sum().reset_index()[REPORT_COLUMNS]
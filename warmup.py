@@ -0,0 +1,71 @@
+"""Background warm-up of module aggregates and artifacts.
+
+At most one warm-up runs per process. Starting one for a new data version,
+or calling cancel(), stops the previous one: queued modules are dropped and
+running ones stop at their next question.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_current = None
+
+
+class Warmup:
+    def __init__(self, version, tasks, workers=WORKERS):
+        """``tasks`` maps a label to a callable taking the cancellation event."""
+        self.version = version
+        self.total = len(tasks)
+        self.completed = 0
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmup")
+        for label, task in tasks.items():
+            self._pool.submit(self._run, label, task)
+        self._pool.shutdown(wait=False)
+
+    def _run(self, label, task):
+        if self.cancelled.is_set():
+            return
+        try:
+            with metrics.span("warmup", task=label):
+                task(self.cancelled)
+        except Exception:
+            logger.exception("Warm-up of %s failed", label)
+        finally:
+            with self._lock:
+                self.completed += 1
+
+    @property
+    def done(self):
+        return self.cancelled.is_set() or self.completed >= self.total
+
+    def cancel(self):
+        self.cancelled.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start(version, make_tasks, workers=WORKERS):
+    """Return the warm-up for ``version``, starting it (and cancelling any
+    other) if needed. ``make_tasks()`` is only called when starting."""
+    global _current
+    with _lock:
+        if _current is not None and _current.version == version and not _current.cancelled.is_set():
+            return _current
+        if _current is not None:
+            _current.cancel()
+        _current = Warmup(version, make_tasks(), workers)
+        return _current
+
+
+def cancel():
+    with _lock:
+        if _current is not None:
+            _current.cancel()